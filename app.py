@@ -1,15 +1,48 @@
-import altair as alt
-from great_tables import loc, style
+import time
+
+# Start of the script run, to measure import time and time to first render
+app_start_time = time.perf_counter()
+
 import polars as pl
 import streamlit as st
 
+from config import COST_AVERAGE_OPTIONS, INVESTMENT_HORIZON_OPTIONS, MAX_MONTHS_OPTIONS, PERCENT_OPTIONS
+import src.answer_table as answer_table
+import src.background as background
+import src.comparison as comparison
 import src.main as main
+from src.instrumentation import record_render
 from data.texts import GermanTextStorage, EnglishTextStorage, TextStorage
 
-@st.cache_data
-def run_strategy(strategy_dict:dict)->dict:
-    result_dict = main.run(strategy_dict)
-    return result_dict
+import_seconds = time.perf_counter() - app_start_time
+
+def start_strategy_job(strategy_dict:dict)->None:
+    # Run in a background thread (answered from the cache of main.run if possible), replacing a still running job
+    if 'strategy_job' in st.session_state:
+        st.session_state['strategy_job'].cancel()
+    st.session_state['strategy_job'] = background.submit_strategy(
+        strategy_dict, track_timings=bool(st.session_state.get('show_diagnostics')))
+    return
+
+def wait_for_strategy_job(strategy_dict:dict)->dict:
+    # Cancel the job if the inputs changed since it was started, its result is no longer of interest
+    job = st.session_state['strategy_job']
+    if job.strategy_dict != strategy_dict:
+        job.cancel()
+        del st.session_state['strategy_job']
+        return None
+    
+    # Show progress until the job is done, changing an input interrupts the wait with a rerun
+    progress_bar = st.progress(job.progress, text=text_store.progress_text)
+    while not job.done():
+        time.sleep(0.05)
+        progress_bar.progress(job.progress, text=text_store.progress_text)
+    progress_bar.empty()
+    
+    del st.session_state['strategy_job']
+    if job.timings is not None:
+        st.session_state['diagnostics'] = job.timings
+    return job.result()
 
 def select_lang_and_index()->tuple[bool, str]:
     indices_available = ['MSCI World','DAX','S&P500','NASDAQ']
@@ -34,12 +67,14 @@ def get_lang_specific_texts()->TextStorage:
     return text_store
 
 def add_year_slider()->None:
-    min_year = quote_data['Date'].min().year
-    max_year = quote_data['Date'].max().year
+    min_year = index_metadata['min_year']
+    max_year = index_metadata['max_year']
     st.slider(text_store.slider_label, min_year, max_year,(min_year, max_year), key='date_tuple')
     return
 
 def plot_index_line_chart()->None:
+    # Imported on first use, altair is slow to import and not needed to render the inputs
+    import altair as alt
     c = alt.Chart(quote_data).mark_line().encode(
         alt.X('Date').title(text_store.chart_x_axis),
         alt.Y('Close').scale(zero=False).title(text_store.chart_y_axis)
@@ -50,7 +85,7 @@ def plot_index_line_chart()->None:
 def select_time_horizon_cost_average()->tuple[str,int]:
 
     # Prepare mapping of investment horizon strings to ints
-    horizon_options = [1, 5, 10, 15, 20]
+    horizon_options = INVESTMENT_HORIZON_OPTIONS
     investment_horizon_mapping = {f'{year} {text_store.years}':year 
                                   for year in horizon_options}
     investment_horizon_mapping['max'] = 0
@@ -65,7 +100,7 @@ def select_time_horizon_cost_average()->tuple[str,int]:
     investment_horizon = investment_horizon_mapping[investment_horizon_choice]
     
     # Prepare mapping of cost_average option strings to ints
-    cost_average_options = [3, 6, 12]
+    cost_average_options = COST_AVERAGE_OPTIONS
     cost_average_mapping = {f'{months} {text_store.months}':months 
                                   for months in cost_average_options}
     cost_average_mapping[text_store.dont_use] = 0
@@ -87,10 +122,10 @@ def select_time_horizon_cost_average()->tuple[str,int]:
 def select_strategy_inputs()->tuple[int, int]:
     
     # Get down percent inputs
-    down_percent = st.number_input(text_store.down_percent_description, 0, 100, 0)
+    down_percent = st.number_input(text_store.down_percent_description, PERCENT_OPTIONS[0], PERCENT_OPTIONS[-1], 0)
     
     # Prepare mapping of max_months option strings to ints
-    max_months_options = [1, 3, 6, 12, 24]
+    max_months_options = MAX_MONTHS_OPTIONS
     max_months_mapping = {f'{months} {text_store.months}':months 
                                   for months in max_months_options}
     max_months_mapping[text_store.dont_use] = 0
@@ -126,6 +161,29 @@ def display_results()->None:
              + str(result_dict["perc_not_invested"]) + '%**')
     return
 
+def plot_result_distributions()->None:
+    # Histograms of the answer table or of the per start date results returned by run, no recomputation needed
+    import altair as alt
+    histograms = result_dict.get('histograms') or main.get_distribution_histograms(result_dict['distribution'])
+    left, right = st.columns(2)
+    for column, values_col, x_title in [(left, 'annualized_return', text_store.return_distribution_x_axis),
+                                        (right, 'days_waited_to_invest', text_store.days_waited_distribution_x_axis)]:
+        bin_edges = histograms[values_col]['bin_edges']
+        histogram_df = pl.DataFrame({'bin_start':bin_edges[:-1], 'bin_end':bin_edges[1:],
+                                     'count':histograms[values_col]['counts']})
+        c = alt.Chart(histogram_df).mark_bar().encode(
+            alt.X('bin_start:Q', bin='binned').title(x_title),
+            alt.X2('bin_end'),
+            alt.Y('count:Q').title(text_store.distribution_y_axis)
+            )
+        column.altair_chart(c, use_container_width=True)
+    return
+
+def display_diagnostics()->None:
+    with st.expander(text_store.diagnostics_title):
+        st.dataframe(pl.from_dicts(st.session_state['diagnostics'], infer_schema_length=None), use_container_width=True)
+    return
+
 def create_result_df(input_dict={}, output_dict={})->pl.DataFrame:
 
     result_df_dict = {
@@ -140,6 +198,7 @@ def create_result_df(input_dict={}, output_dict={})->pl.DataFrame:
         'average days waited': output_dict['average_days_waited'],
         '% not invested': output_dict['perc_not_invested'],
         '90% return interval': str(output_dict['bottom_pctile']) + ' : ' + str(output_dict['top_pctile']),
+        '90% CI of % return per year': str(output_dict['average_return_bottom']) + ' : ' + str(output_dict['average_return_top']),
         'min return (%)':str(output_dict['min']),
         'max return (%)':str(output_dict['max']),
         'return std (%)': str(output_dict['std']),
@@ -158,18 +217,14 @@ st.title(text_store.title)
 # Select Index & language to use
 german_language, index_chosen = select_lang_and_index()
 
-# Load data from CSVs
-quote_data = main.import_historical_quote_data(index_chosen)
-
-# Normalize index levels to start at 100
-quote_data = main.normalize_prices(quote_data)
+# Load year bounds of the index, computed once per process
+index_metadata = main.get_index_metadata(index_chosen)
 
 # Add possibility to slice the date range
 add_year_slider()
 
-# Filter dataset according to date range chosen in slider
-quote_data = quote_data.filter((pl.col('Date').dt.year() >= st.session_state['date_tuple'][0])
-                               & (pl.col('Date').dt.year() <= st.session_state['date_tuple'][1]))
+# Quotes (normalized to start at 100) of the date range chosen in slider, downsampled to the resolution of the chart
+quote_data = main.get_chart_quotes(index_chosen, *st.session_state['date_tuple'])
 
 # Plot index prices as line chart
 plot_index_line_chart()
@@ -192,16 +247,35 @@ strategy_dict = {
     'percent':down_percent,
     'investment_horizon':investment_horizon,
     'cost_average_months':cost_average,
+    'include_distribution':True,
     }
 
 # If button clicked, run strategy
 run_strategy_button = st.button(text_store.run_button_text)
+compare_button = st.button(text_store.compare_button_text)
+st.toggle(text_store.diagnostics_toggle, key='show_diagnostics')
+if compare_button:
+    # Same strategy on all indices side by side, sharing one aligned calendar
+    comparison_strategy_dict = {key:value for key, value in strategy_dict.items() 
+                                if key not in ('index', 'include_distribution')}
+    try:
+        st.session_state['comparison_df'] = comparison.run_comparison(comparison_strategy_dict,
+                                                                      include_bootstrap=True)
+    except ValueError as e:
+        st.error(str(e))
+result_dict = None
 if run_strategy_button:
+    # Answer from the precomputed table (histograms included) if possible, else compute in the background
+    result_dict = answer_table.lookup(strategy_dict)
+    if result_dict is None:
+        start_strategy_job(strategy_dict)
+if result_dict is None and 'strategy_job' in st.session_state:
+    result_dict = wait_for_strategy_job(strategy_dict)
+if result_dict is not None:
     if 'run_counter' not in st.session_state:
         st.session_state['run_counter'] = 1
     else:
         st.session_state['run_counter'] += 1
-    result_dict = run_strategy(strategy_dict)
     st.session_state['result_dict'] = result_dict
     
     # Display all past results in table
@@ -220,6 +294,16 @@ if 'result_dict' in st.session_state:
     st.markdown(f'### {text_store.strategy_results}')
     result_dict = st.session_state['result_dict']
     display_results()
+    if 'distribution' in result_dict or 'histograms' in result_dict:
+        st.markdown(f'#### {text_store.distribution_title}')
+        plot_result_distributions()
+    if st.session_state.get('show_diagnostics') and 'diagnostics' in st.session_state:
+        display_diagnostics()
+
+if 'comparison_df' in st.session_state:
+    st.divider()
+    st.markdown(f'### {text_store.comparison_results}')
+    st.dataframe(st.session_state['comparison_df'], use_container_width=True)
 
 if 'result_df' in st.session_state:
     # Display table
@@ -233,3 +317,6 @@ if 'result_df' in st.session_state:
         del st.session_state['run_counter']
         del st.session_state['result_dict']
         st.rerun()
+
+# Record import time and time to render the page
+record_render(import_seconds, time.perf_counter() - app_start_time)
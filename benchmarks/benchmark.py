@@ -0,0 +1,230 @@
+"""Benchmarks for main.run and its stages.
+
+Usage (from the repository root):
+    python -m benchmarks.benchmark run --output benchmarks/current.json
+    python -m benchmarks.benchmark compare benchmarks/baseline.json benchmarks/current.json --threshold 0.2
+"""
+import argparse
+import datetime
+import itertools
+import json
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import polars as pl
+
+from config import ENGINE_VERSION
+from src import main
+
+# Representative parameter matrix: horizons, cost averaging and max months
+PARAMETER_MATRIX = {
+    'percent':[0, 10],
+    'months':[0, 3, 12],
+    'investment_horizon':[0, 1, 5, 10, 20],
+    'cost_average_months':[0, 3, 12],
+}
+QUICK_PARAMETER_MATRIX = {
+    'percent':[10],
+    'months':[0, 3],
+    'investment_horizon':[0, 10],
+    'cost_average_months':[0, 12],
+}
+
+def get_rss_bytes(field:str)->int:
+    # Current (VmRSS) or peak (VmHWM) resident memory of this process, None where /proc isn't available
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1])*1024 for line in f if line.startswith(f'{field}:'))
+    except (OSError, StopIteration):
+        return None
+
+def reset_peak_rss()->bool:
+    # Reset the peak resident memory to the current one (Linux), so the next peak is that of a single call
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def measure_peak_rss(func)->dict:
+    """Peak resident memory of one call, incl. memory of Polars and Arrow that tracemalloc doesn't see
+
+    Returns:
+        dict: peak resident memory of the process during the call and its increase over the memory before the call,
+            None if the peak can't be reset on this platform
+    """
+    if not reset_peak_rss():
+        return {'peak_rss_bytes':None, 'rss_increase_bytes':None}
+    start_rss_bytes = get_rss_bytes('VmRSS')
+    func()
+    peak_rss_bytes = get_rss_bytes('VmHWM')
+    return {'peak_rss_bytes':peak_rss_bytes, 'rss_increase_bytes':peak_rss_bytes - start_rss_bytes}
+
+def measure(func, repeats:int)->dict:
+    """Time a function over several repeats and record the peak of Python allocations and of resident memory"""
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start_time)
+    tracemalloc.start()
+    func()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'median_s':statistics.median(timings), 'min_s':min(timings), 'peak_traced_bytes':peak_bytes,
+            **measure_peak_rss(func)}
+
+# Run in a fresh interpreter per repeat, so every measurement is a cold start of the app
+STARTUP_SCRIPT = """
+import json, resource, time
+start_time = time.perf_counter()
+import streamlit, polars, src.main, src.answer_table, src.background, src.comparison
+import_seconds = time.perf_counter() - start_time
+from streamlit.testing.v1 import AppTest
+from src import instrumentation
+AppTest.from_file('app.py', default_timeout=600).run()
+print(json.dumps({'import_s':import_seconds, 'render_s':instrumentation.get_render_timings()[0]['render_s'],
+                  'max_rss_bytes':resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024}))
+"""
+
+def measure_startup(repeats:int)->list[dict]:
+    """Time the imports of the app (streamlit, polars and the modules of the app) and the first render of the page,
+    each in a new process. The render is timed with these modules already imported, so it excludes the imports.
+    The peak resident memory of the process is recorded with the render"""
+    timings = [json.loads(subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], capture_output=True, text=True,
+                                         check=True).stdout.splitlines()[-1])
+               for _ in range(repeats)]
+    startup_results = [{'name':name, 'params':{}, 'median_s':statistics.median(timing[key] for timing in timings),
+                        'min_s':min(timing[key] for timing in timings)}
+                       for name, key in [('app_imports', 'import_s'), ('app_first_render', 'render_s')]]
+    startup_results[1]['peak_rss_bytes'] = max(timing['max_rss_bytes'] for timing in timings)
+    return startup_results
+
+def get_strategy_dicts(index:str, parameter_matrix:dict)->list[dict]:
+    quotes_df = main.import_historical_quote_data(index)
+    min_year, max_year = quotes_df['Date'].min().year, quotes_df['Date'].max().year
+    return [{'index':index, 'min_year':min_year, 'max_year':max_year, **dict(zip(parameter_matrix, values))}
+            for values in itertools.product(*parameter_matrix.values())]
+
+def benchmark_strategy(strategy_dict:dict, repeats:int)->list[dict]:
+    """Benchmark the stages of main.run and the uncached run for one strategy dict"""
+    uncached_run = main.run.__wrapped__
+    quotes_df = main.filter_quotes_by_year(main.import_historical_quote_data(strategy_dict['index']),
+                                           strategy_dict['min_year'], strategy_dict['max_year'])
+    strategy_dates_df = main.get_strategy_results(quotes_df, strategy_dict)
+
+    def run_without_cache():
+        main.clear_caches()
+        uncached_run(strategy_dict)
+
+    stages = {
+        'get_strategy_results':lambda: main.get_strategy_results(quotes_df, strategy_dict),
+        'calculate_total_return_from_df':lambda: main.calculate_total_return_from_df(quotes_df, strategy_dates_df, strategy_dict),
+        'run':run_without_cache,
+    }
+    return [{'name':name, 'params':strategy_dict, **measure(func, repeats)} for name, func in stages.items()]
+
+def run_benchmarks(indices:list[str], parameter_matrix:dict, repeats:int)->dict:
+    results = measure_startup(repeats)
+    for index in indices:
+        results.append({'name':'import_historical_quote_data', 'params':{'index':index},
+                        **measure(lambda: main.import_historical_quote_data(index), repeats)})
+        for strategy_dict in get_strategy_dicts(index, parameter_matrix):
+            try:
+                results.extend(benchmark_strategy(strategy_dict, repeats))
+            except ValueError:
+                # Investment horizon larger than the available history
+                continue
+        print(f'{index}: done', file=sys.stderr)
+
+    return {
+        'meta':{
+            'timestamp':datetime.datetime.now().isoformat(timespec='seconds'),
+            'engine_version':ENGINE_VERSION,
+            'python':platform.python_version(),
+            'polars':pl.__version__,
+            'numpy':np.__version__,
+            'machine':platform.machine(),
+            'repeats':repeats,
+        },
+        'max_rss_bytes':resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024,
+        'results':results,
+    }
+
+def get_result_key(result:dict)->str:
+    return result['name'] + ' ' + json.dumps(result['params'], sort_keys=True)
+
+def compare_results(baseline:dict, current:dict, threshold:float, min_delta_s:float=0.001)->list[dict]:
+    """Compare median timings per benchmark, flagging slowdowns larger than the threshold (e.g. 0.2 = 20%) 
+    and larger than min_delta_s, so sub-millisecond noise isn't reported"""
+    baseline_by_key = {get_result_key(result):result for result in baseline['results']}
+    comparisons = []
+    for result in current['results']:
+        baseline_result = baseline_by_key.get(get_result_key(result))
+        if baseline_result is None:
+            continue
+        ratio = result['median_s'] / baseline_result['median_s'] if baseline_result['median_s'] else float('inf')
+        comparisons.append({
+            'key':get_result_key(result),
+            'baseline_s':baseline_result['median_s'],
+            'current_s':result['median_s'],
+            'ratio':ratio,
+            'regression':ratio > 1 + threshold and result['median_s'] - baseline_result['median_s'] > min_delta_s,
+        })
+    return comparisons
+
+def summarize_by_stage(comparisons:list[dict])->dict:
+    """Geometric mean of the timing ratios per stage"""
+    ratios_by_stage = {}
+    for comparison in comparisons:
+        ratios_by_stage.setdefault(comparison['key'].split(' ')[0], []).append(comparison['ratio'])
+    return {stage:float(np.exp(np.mean(np.log(ratios)))) for stage, ratios in ratios_by_stage.items()}
+
+def main_cli(argv:list[str]=None)->int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmarks and write the results as JSON')
+    run_parser.add_argument('--output', default='benchmarks/current.json')
+    run_parser.add_argument('--indices', nargs='+', default=list(main.INDEX_FILE_MAPPING))
+    run_parser.add_argument('--repeats', type=int, default=3)
+    run_parser.add_argument('--quick', action='store_true', help='use a smaller parameter matrix')
+
+    compare_parser = subparsers.add_parser('compare', help='flag regressions against a stored baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.2)
+    compare_parser.add_argument('--min-delta-ms', type=float, default=1.0)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        parameter_matrix = QUICK_PARAMETER_MATRIX if args.quick else PARAMETER_MATRIX
+        benchmark_results = run_benchmarks(args.indices, parameter_matrix, args.repeats)
+        with open(args.output, 'w') as f:
+            json.dump(benchmark_results, f, indent=2)
+        print(f'Wrote {len(benchmark_results["results"])} results to {args.output}')
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    comparisons = compare_results(baseline, current, args.threshold, args.min_delta_ms/1000)
+    for stage, ratio in summarize_by_stage(comparisons).items():
+        print(f'{stage:<32} {ratio:6.2f}x of baseline')
+    regressions = [comparison for comparison in comparisons if comparison['regression']]
+    for regression in regressions:
+        print(f'REGRESSION {regression["ratio"]:.2f}x  {regression["key"]}')
+    print(f'{len(regressions)} regressions in {len(comparisons)} compared benchmarks')
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -1,4 +1,51 @@
 DATE_SEP = '-'
 THOUSAND_SEP = ','
 DATE_FORMAT = f'%Y{DATE_SEP}%m{DATE_SEP}%d'
-MONTH_DAYS = 30
\ No newline at end of file
+# Format of intraday quotes (e.g. minute bars)
+DATETIME_FORMAT = f'{DATE_FORMAT} %H:%M:%S'
+MONTH_DAYS = 30
+
+# Result cache settings, bump ENGINE_VERSION whenever cached results change
+ENGINE_VERSION = '3'
+CACHE_DIR = 'cache'
+CACHE_MEMORY_MAX_ENTRIES = 512
+CACHE_DISK_SIZE_LIMIT = 2**30
+CACHE_TTL_SECONDS = None
+# Concurrent misses of the same cache key (across threads and processes sharing CACHE_DIR) are computed once:
+# callers wait up to SINGLE_FLIGHT_WAIT_SECONDS for the running computation before computing themselves, a crashed
+# computation is taken over once its lease (renewed while it runs) expires
+SINGLE_FLIGHT_WAIT_SECONDS = 300
+SINGLE_FLIGHT_LEASE_SECONDS = 30
+SINGLE_FLIGHT_POLL_SECONDS = 0.05
+
+# Number of full history strategy results kept in memory to answer year windows by slicing
+FULL_HISTORY_CACHE_SIZE = 64
+# Block bootstrap of the average annualized return, blocks of about one year of start dates
+BOOTSTRAP_RESAMPLES = 10_000
+BOOTSTRAP_BLOCK_LENGTH = 250
+BOOTSTRAP_CONFIDENCE = 0.9
+BOOTSTRAP_SEED = 0
+# Max block starts drawn at once per bootstrap batch, about 32 bytes each
+BOOTSTRAP_BATCH_SIZE = 2**20
+
+# Background runs of the app: start dates per progress step and max runs computed at the same time
+RUN_CHUNK_SIZE = 2000
+BACKGROUND_MAX_WORKERS = 4
+
+# Max points of the index chart of the app (min and max of equally sized buckets) and downsampled windows kept in memory
+CHART_MAX_POINTS = 1000
+CHART_CACHE_SIZE = 64
+# Bins of the histograms of the per start date results
+DISTRIBUTION_BINS = 40
+
+# Parameter options of the app, 0 stands for "max" (horizon) or "do not use" (months, cost average)
+PERCENT_OPTIONS = list(range(0, 101))
+MAX_MONTHS_OPTIONS = [1, 3, 6, 12, 24]
+INVESTMENT_HORIZON_OPTIONS = [1, 5, 10, 15, 20]
+COST_AVERAGE_OPTIONS = [3, 6, 12]
+
+# Precomputed results of all app options for the full history of every index
+ANSWER_TABLE_PATH = 'data/store/answer_table'
+
+# Chunked engine for long (e.g. intraday) histories: max memory of one run, start rows per chunk are derived from it
+CHUNKED_MEMORY_BUDGET_BYTES = 512 * 2**20
@@ -29,6 +29,15 @@ class TextStorage():
     strategy_results:str
     all_results:str
     clear_button:str
+    diagnostics_toggle:str
+    diagnostics_title:str
+    distribution_title:str
+    return_distribution_x_axis:str
+    days_waited_distribution_x_axis:str
+    distribution_y_axis:str
+    compare_button_text:str
+    comparison_results:str
+    progress_text:str
            
 class EnglishTextStorage(TextStorage):
     def __init__(self) -> None:
@@ -70,6 +79,15 @@ class EnglishTextStorage(TextStorage):
         self.strategy_results = 'Current strategy results:'
         self.all_results = 'All results:'
         self.clear_button = 'Clear table'
+        self.diagnostics_toggle = 'Show diagnostics'
+        self.diagnostics_title = 'Diagnostics (time per stage)'
+        self.distribution_title = 'Distribution across start dates'
+        self.return_distribution_x_axis = 'Return per year (%)'
+        self.days_waited_distribution_x_axis = 'Days waited before investing'
+        self.distribution_y_axis = 'Number of start dates'
+        self.compare_button_text = 'Compare all indices'
+        self.comparison_results = 'Strategy on all indices:'
+        self.progress_text = 'Running strategy for all start dates...'
         
 class GermanTextStorage(TextStorage):
     def __init__(self) -> None:
@@ -109,4 +127,13 @@ class GermanTextStorage(TextStorage):
         self.strategy_results = 'Ergebnis der aktuellen Strategie:'
         self.all_results = 'Alle Ergebnisse:'
         self.clear_button = 'Tabelle zurücksetzen'
+        self.diagnostics_toggle = 'Diagnose anzeigen'
+        self.diagnostics_title = 'Diagnose (Zeit pro Schritt)'
+        self.distribution_title = 'Verteilung über alle Einstiegsdaten'
+        self.return_distribution_x_axis = 'Rendite pro Jahr (%)'
+        self.days_waited_distribution_x_axis = 'Wartezeit in Tagen bis zum Investment'
+        self.distribution_y_axis = 'Anzahl Einstiegsdaten'
+        self.compare_button_text = 'Alle Indizes vergleichen'
+        self.comparison_results = 'Strategie auf allen Indizes:'
+        self.progress_text = 'Strategie wird für alle Einstiegsdaten berechnet...'
        
\ No newline at end of file
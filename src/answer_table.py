@@ -0,0 +1,207 @@
+"""Precomputed results of all parameter combinations of the app for the full history of every index.
+
+Usage (from the repository root):
+    python -m src.answer_table --workers 4
+
+The results are stored as one dense float64 array (index x percent x months x investment horizon x cost average
+months x metric) that is memory-mapped on lookup, so answering a request is a few array index operations.
+The distributions of the per start date results are stored as histograms (bounds and counts of DISTRIBUTION_BINS
+bins per series) in two more arrays of the same parameter axes. Requests for other year windows or with other
+options fall back to the live computation.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import polars as pl
+
+from config import (ANSWER_TABLE_PATH, COST_AVERAGE_OPTIONS, DISTRIBUTION_BINS, ENGINE_VERSION,
+                    INVESTMENT_HORIZON_OPTIONS, MAX_MONTHS_OPTIONS, PERCENT_OPTIONS)
+from src import main
+
+# Axes of the table in order, the metric axis comes last
+PARAMETER_KEYS = ['index', 'percent', 'months', 'investment_horizon', 'cost_average_months']
+METRICS = ['average_annualized_return', 'average_days_waited', 'perc_not_invested', 'bottom_pctile', 'top_pctile',
+           'std', 'min', 'max', 'average_return_se', 'average_return_bottom', 'average_return_top']
+INT_METRICS = ['average_days_waited']
+
+# Optional strategy dict keys, include_distribution is answered with the stored histograms
+OPTIONAL_KEYS = ['include_distribution']
+
+def get_table_axes(indices:list[str]=None, percents:list[int]=None)->dict[str, list]:
+    return {
+        'index':list(indices or main.INDEX_FILE_MAPPING),
+        'percent':list(percents if percents is not None else PERCENT_OPTIONS),
+        'months':[0, *MAX_MONTHS_OPTIONS],
+        'investment_horizon':[0, *INVESTMENT_HORIZON_OPTIONS],
+        'cost_average_months':[0, *COST_AVERAGE_OPTIONS],
+    }
+
+def get_full_history_window(index:str)->tuple[int, int]:
+    quotes_df = main.import_historical_quote_data(index)
+    return quotes_df['Date'].min().year, quotes_df['Date'].max().year
+
+def compute_table_slice(index:str, percent:int, axes:dict[str, list])->tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Metrics and histograms of all months x investment horizon x cost average combinations of one index and percent
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: float64 metrics of shape (months, investment horizons, cost
+            average months, metrics), float64 histogram bounds (lower and upper edge) of shape (..., series, 2) and
+            uint32 histogram counts of shape (..., series, bins). Metrics and bounds are NaN if the investment
+            horizon is larger than the history
+    """
+    min_year, max_year = get_full_history_window(index)
+    grid_df = main.run_grid(index, min_year, max_year, [percent], axes['months'], axes['investment_horizon'],
+                            axes['cost_average_months'], include_bootstrap=True,
+                            include_histograms=True)
+    metrics_df = grid_df.select([pl.col(metric).cast(pl.Float64) if metric in grid_df.columns
+                                 else pl.lit(None, dtype=pl.Float64).alias(metric) for metric in METRICS])
+
+    # Histograms of combinations without results stay empty
+    histogram_bounds = np.full((grid_df.height, len(main.DISTRIBUTION_SERIES), 2), np.nan)
+    histogram_counts = np.zeros((grid_df.height, len(main.DISTRIBUTION_SERIES), DISTRIBUTION_BINS), dtype=np.uint32)
+    for series_number, series in enumerate(main.DISTRIBUTION_SERIES):
+        if f'{series}_counts' not in grid_df.columns:
+            continue
+        for row, (bin_edges, counts) in enumerate(zip(grid_df[f'{series}_bin_edges'], grid_df[f'{series}_counts'])):
+            if counts is not None:
+                histogram_bounds[row, series_number] = bin_edges[0], bin_edges[-1]
+                histogram_counts[row, series_number] = counts.to_numpy()
+
+    # run_grid returns the combinations in itertools.product order of its arguments
+    shape = (len(axes['months']), len(axes['investment_horizon']), len(axes['cost_average_months']))
+    return (metrics_df.fill_null(float('nan')).to_numpy().reshape(*shape, len(METRICS)),
+            histogram_bounds.reshape(*shape, *histogram_bounds.shape[1:]),
+            histogram_counts.reshape(*shape, *histogram_counts.shape[1:]))
+
+def _compute_table_slice(task:tuple[str, int, dict])->tuple[np.ndarray, np.ndarray, np.ndarray]:
+    return compute_table_slice(*task)
+
+def get_table_paths(path:str)->dict[str, str]:
+    return {'table':f'{path}.npy', 'histogram_bounds':f'{path}.histogram_bounds.npy',
+            'histogram_counts':f'{path}.histogram_counts.npy', 'metadata':f'{path}.json'}
+
+def build_answer_table(path:str=ANSWER_TABLE_PATH, indices:list[str]=None, percents:list[int]=None,
+                       max_workers:int=None)->None:
+    """Compute all parameter combinations for the full history of every index and write the table
+
+    Args:
+        path (str): path of the table without extension, writes the files of get_table_paths
+        indices (list[str], optional): indices to include, defaults to all
+        percents (list[int], optional): percent options to include, defaults to all options of the app
+        max_workers (int, optional): number of worker processes, defaults to the number of CPUs
+    """
+    axes = get_table_axes(indices, percents)
+    tasks = [(index, percent, axes) for index, percent in itertools.product(axes['index'], axes['percent'])]
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        table_slices = list(pool.map(_compute_table_slice, tasks))
+    axes_shape = [len(values) for values in axes.values()]
+    arrays = {name:np.stack([table_slice[number] for table_slice in table_slices]).reshape(
+                  axes_shape + list(table_slices[0][number].shape[3:]))
+              for number, name in enumerate(['table', 'histogram_bounds', 'histogram_counts'])}
+
+    metadata = {
+        'engine_version':ENGINE_VERSION,
+        'axes':axes,
+        'metrics':METRICS,
+        'distribution_series':main.DISTRIBUTION_SERIES,
+        'windows':{index:get_full_history_window(index) for index in axes['index']},
+        'data_fingerprints':{index:main.get_full_history_fingerprint(index) for index in axes['index']},
+    }
+
+    # Write to temp files first so running apps never load a partially written table, the metadata last as its
+    # modification time marks a new table
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table_paths = get_table_paths(path)
+    for name, array in arrays.items():
+        with open(f'{table_paths[name]}.tmp', 'wb') as f:
+            np.save(f, array)
+    with open(f'{table_paths["metadata"]}.tmp', 'w') as f:
+        json.dump(metadata, f)
+    for table_path in table_paths.values():
+        os.replace(f'{table_path}.tmp', table_path)
+
+class AnswerTable():
+    def __init__(self, path:str=ANSWER_TABLE_PATH) -> None:
+        """Memory-mapped lookup of precomputed result dicts by parameter combination
+
+        Args:
+            path (str): path of the table without extension
+        """
+        table_paths = get_table_paths(path)
+        with open(table_paths['metadata']) as f:
+            self.metadata = json.load(f)
+        self.table = np.load(table_paths['table'], mmap_mode='r')
+        # Tables built without histograms only answer requests without distribution
+        if 'distribution_series' in self.metadata:
+            self.histogram_bounds = np.load(table_paths['histogram_bounds'], mmap_mode='r')
+            self.histogram_counts = np.load(table_paths['histogram_counts'], mmap_mode='r')
+        self.positions = {key:{value:position for position, value in enumerate(values)}
+                          for key, values in self.metadata['axes'].items()}
+
+    def lookup(self, strategy_dict:dict)->dict:
+        """Result dict of main.run for a strategy dict, None if it isn't in the table. If a distribution is requested,
+        the dict holds its histograms (see main.get_distribution_histograms) under the key histograms"""
+        if set(strategy_dict) - set(OPTIONAL_KEYS) != {*PARAMETER_KEYS, 'min_year', 'max_year'}:
+            return None
+        index = strategy_dict['index']
+        if (self.metadata['engine_version'] != ENGINE_VERSION or index not in self.positions['index']
+            or [strategy_dict['min_year'], strategy_dict['max_year']] != self.metadata['windows'][index]):
+            return None
+        try:
+            position = tuple(self.positions[key][strategy_dict[key]] for key in PARAMETER_KEYS)
+        except KeyError:
+            return None
+
+        # Results of outdated data or failed combinations (NaN) are computed live
+        values = self.table[position]
+        if np.isnan(values).any() or main.get_full_history_fingerprint(index) != self.metadata['data_fingerprints'][index]:
+            return None
+        result_dict = {metric:int(value) if metric in INT_METRICS else round(float(value), 2)
+                       for metric, value in zip(self.metadata['metrics'], values)}
+        if strategy_dict.get('include_distribution'):
+            if 'distribution_series' not in self.metadata or np.isnan(self.histogram_bounds[position]).any():
+                return None
+            # The bin edges of np.histogram are evenly spaced between the stored bounds
+            n_bins = self.histogram_counts.shape[-1]
+            result_dict['histograms'] = {
+                series:{'bin_edges':np.linspace(*self.histogram_bounds[position][series_number], n_bins + 1),
+                        'counts':np.array(self.histogram_counts[position][series_number])}
+                for series_number, series in enumerate(self.metadata['distribution_series'])}
+        return result_dict
+
+# Table of the app, reloaded when the table files are replaced
+_answer_tables = {}
+
+def get_answer_table(path:str=ANSWER_TABLE_PATH)->AnswerTable:
+    """Loaded answer table, None if it wasn't built"""
+    try:
+        modified_time = os.stat(f'{path}.json').st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if _answer_tables.get(path, (None, None))[0] != modified_time:
+        _answer_tables[path] = (modified_time, AnswerTable(path))
+    return _answer_tables[path][1]
+
+def lookup(strategy_dict:dict, path:str=ANSWER_TABLE_PATH)->dict:
+    answer_table = get_answer_table(path)
+    return answer_table.lookup(strategy_dict) if answer_table is not None else None
+
+def main_cli(argv:list[str]=None)->int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default=ANSWER_TABLE_PATH, help='path of the table without extension')
+    parser.add_argument('--indices', nargs='+', default=None)
+    parser.add_argument('--percents', nargs='+', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    build_answer_table(args.output, args.indices, args.percents, args.workers)
+    print(f'Wrote answer table to {args.output}.npy')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
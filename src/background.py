@@ -0,0 +1,74 @@
+import contextlib
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from config import BACKGROUND_MAX_WORKERS
+from src import caching, main
+from src.instrumentation import collect_timings, stage
+
+# Threads shared by all sessions, so the number of concurrently computed runs stays bounded
+_executor = ThreadPoolExecutor(max_workers=BACKGROUND_MAX_WORKERS, thread_name_prefix='strategy_run')
+
+class StrategyJob():
+    def __init__(self, strategy_dict:dict, track_timings:bool=False) -> None:
+        """Run of a strategy dict in a background thread, with progress and cooperative cancellation
+
+        Args:
+            strategy_dict (dict): strategy dict as accepted by main.run
+            track_timings (bool): record the stage timings of the run in timings
+        """
+        self.strategy_dict = strategy_dict
+        self.track_timings = track_timings
+        self.progress = 0.0
+        self.timings = None
+        self.cancel_event = threading.Event()
+        self.future:Future = None
+
+    def set_progress(self, progress:float)->None:
+        self.progress = progress
+
+    def run(self)->dict:
+        # Answer from the result cache of main.run if possible, else compute in chunks and store the result
+        collector_context = collect_timings() if self.track_timings else contextlib.nullcontext()
+        with collector_context as collector:
+            with stage('total'):
+                start_time = time.perf_counter()
+                key = main.run.cache_key(self.strategy_dict)
+                with stage('cache_lookup'):
+                    result_dict = caching.cache.get(key)
+                if result_dict is not None:
+                    caching.cache.record(hit=True, seconds=time.perf_counter() - start_time)
+                else:
+                    # Computed once if several sessions run the same strategy dict at the same time
+                    result_dict, computed = caching.single_flight(
+                        key, lambda: main.run_in_chunks(self.strategy_dict, progress_callback=self.set_progress,
+                                                        cancel_event=self.cancel_event),
+                        check_cancelled=self.check_cancelled)
+                    caching.cache.record(hit=not computed, seconds=time.perf_counter() - start_time, 
+                                         coalesced=not computed)
+        if collector is not None:
+            self.timings = collector.to_dicts()
+        self.progress = 1.0
+        return result_dict
+
+    def check_cancelled(self)->None:
+        if self.cancel_event.is_set():
+            raise main.RunCancelled(f'Run of {self.strategy_dict} was cancelled')
+
+    def cancel(self)->None:
+        """Stop the run, jobs not started yet are dropped and running ones stop before their next chunk"""
+        self.cancel_event.set()
+        self.future.cancel()
+
+    def done(self)->bool:
+        return self.future.done()
+
+    def result(self, timeout:float=None)->dict:
+        """Result dict of the run, raises its exception (CancelledError or main.RunCancelled if it was cancelled)"""
+        return self.future.result(timeout)
+
+def submit_strategy(strategy_dict:dict, track_timings:bool=False)->StrategyJob:
+    job = StrategyJob(strategy_dict, track_timings)
+    job.future = _executor.submit(job.run)
+    return job
@@ -0,0 +1,220 @@
+"""Headless batch runner for strategy configs, streaming the results to Parquet.
+
+Usage (from the repository root):
+    python -m src.batch configs.json --output results/nightly
+    python -m src.batch configs.csv --output results/nightly --part-size 200
+
+Configs are a JSON list of strategy dicts (as accepted by main.run) or a CSV with one column per key.
+Results are written to part files in the output directory:
+    summary-<part>.parquet       one row per config with the metrics of main.run, or the error
+    start_dates-<part>.parquet   per start date results of all configs of the part, one row group per config
+Rerunning with the same output directory skips configs of completed parts, so an interrupted batch resumes
+where it stopped.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+
+import polars as pl
+import pyarrow.parquet as pq
+
+from src import caching, main
+
+STRATEGY_KEYS = ['index', 'min_year', 'max_year', 'percent', 'months', 'investment_horizon', 'cost_average_months']
+
+# Types of the strategy keys, percents may be fractional
+STRATEGY_KEY_SCHEMA = {key:pl.String if key == 'index' else pl.Float64 if key == 'percent' else pl.Int64
+                       for key in STRATEGY_KEYS}
+
+SUMMARY_SCHEMA = {
+    'config_id':pl.String,
+    'config':pl.String,
+    **STRATEGY_KEY_SCHEMA,
+    'average_annualized_return':pl.Float64,
+    'average_days_waited':pl.Int64,
+    'perc_not_invested':pl.Float64,
+    'bottom_pctile':pl.Float64,
+    'top_pctile':pl.Float64,
+    'std':pl.Float64,
+    'min':pl.Float64,
+    'max':pl.Float64,
+    'average_return_se':pl.Float64,
+    'average_return_bottom':pl.Float64,
+    'average_return_top':pl.Float64,
+    'error':pl.String,
+}
+
+START_DATE_SCHEMA = {
+    'config_id':pl.String,
+    'start_date':pl.Date,
+    'investment_date':pl.Date,
+    'end_date':pl.Date,
+    'investment_date_price':pl.Float64,
+    'end_date_price':pl.Float64,
+    'total_return':pl.Float64,
+    'days_waited_to_invest':pl.Int64,
+    'days_invested':pl.Int64,
+    'annualized_return':pl.Float64,
+}
+
+def is_valid_value(value, dtype:pl.DataType)->bool:
+    # Values that fit the summary column without a lossy cast
+    if dtype == pl.String:
+        return isinstance(value, str)
+    if isinstance(value, bool):
+        return False
+    return isinstance(value, (int, float)) if dtype == pl.Float64 else isinstance(value, int)
+
+def validate_config(config:dict)->None:
+    """Raise a ValueError if a config misses strategy keys or has strategy values of the wrong type"""
+    missing_keys = [key for key in STRATEGY_KEYS if key not in config]
+    if missing_keys:
+        raise ValueError(f'Config {config} is missing the keys {missing_keys}')
+    invalid_keys = [key for key, dtype in STRATEGY_KEY_SCHEMA.items() if not is_valid_value(config[key], dtype)]
+    if invalid_keys:
+        raise ValueError(f'Config {config} has invalid values for the keys {invalid_keys}')
+
+def read_configs(path:str)->list[dict]:
+    if path.endswith('.csv'):
+        configs = pl.read_csv(path).to_dicts()
+    else:
+        with open(path) as f:
+            configs = json.load(f)
+
+    for config in configs:
+        validate_config(config)
+    return configs
+
+def get_config_id(strategy_dict:dict)->str:
+    return caching.hash_dict(strategy_dict)
+
+def get_part_paths(output_dir:str, kind:str)->list[str]:
+    return sorted(glob.glob(os.path.join(output_dir, f'{kind}-*.parquet')))
+
+def get_completed_config_ids(output_dir:str)->set[str]:
+    """Ids of the configs in completed parts, parts are only renamed to their final name once fully written"""
+    summary_paths = get_part_paths(output_dir, 'summary')
+    if not summary_paths:
+        return set()
+    return set(pl.scan_parquet(summary_paths).select('config_id').collect()['config_id'])
+
+def get_next_part_number(output_dir:str)->int:
+    part_numbers = [int(os.path.basename(path)[len('summary-'):-len('.parquet')])
+                    for path in get_part_paths(output_dir, 'summary')]
+    return max(part_numbers, default=-1) + 1
+
+def get_summary_df(summary:dict)->pl.DataFrame:
+    """One row frame of a summary, a summary that doesn't fit the schema is recorded as an error of its config"""
+    try:
+        return pl.DataFrame([summary], schema=SUMMARY_SCHEMA)
+    except Exception as e:
+        error_summary = {'config_id':summary['config_id'], 'config':summary['config'],
+                         'error':f'Invalid summary, {type(e).__name__}: {e}'}
+        return pl.DataFrame([error_summary], schema=SUMMARY_SCHEMA)
+
+def run_config(strategy_dict:dict)->tuple[dict, pl.DataFrame]:
+    """Summary row and per start date results of one config, errors are recorded in the summary row
+
+    Returns:
+        tuple[dict, pl.DataFrame]: summary row (strategy keys null if the config is invalid) and per start date 
+            results (None if the config failed)
+    """
+    config_id = get_config_id(strategy_dict)
+    summary = {'config_id':config_id, 'config':json.dumps(strategy_dict, sort_keys=True), 'error':None}
+    try:
+        validate_config(strategy_dict)
+        summary.update({key:strategy_dict[key] for key in STRATEGY_KEYS})
+        start_date_df = main.build_strategy_result_query(strategy_dict).collect()
+        summary.update(main.calculate_result_dict(start_date_df, **main.get_bootstrap_options(strategy_dict)))
+    except Exception as e:
+        summary['error'] = f'{type(e).__name__}: {e}'
+        return summary, None
+
+    start_date_df = (start_date_df.with_columns(pl.lit(config_id).alias('config_id'))
+                     .select(list(START_DATE_SCHEMA)).cast(START_DATE_SCHEMA))
+    return summary, start_date_df
+
+class PartWriter():
+    def __init__(self, output_dir:str, part_number:int) -> None:
+        """Writes one part, per start date results are streamed as one row group per config while the
+        (small) summary rows are written when the part is closed
+
+        Args:
+            output_dir (str): directory of the part files
+            part_number (int): number of the part, used in the file names
+        """
+        self.summary_path = os.path.join(output_dir, f'summary-{part_number:05d}.parquet')
+        self.start_dates_path = os.path.join(output_dir, f'start_dates-{part_number:05d}.parquet')
+        arrow_schema = pl.DataFrame(schema=START_DATE_SCHEMA).to_arrow().schema
+        self.start_dates_writer = pq.ParquetWriter(f'{self.start_dates_path}.tmp', arrow_schema, compression='zstd')
+        self.summary_dfs = [pl.DataFrame(schema=SUMMARY_SCHEMA)]
+
+    def write(self, summary:dict, start_date_df:pl.DataFrame)->bool:
+        """Add the results of one config
+
+        Returns:
+            bool: whether the config failed (incl. a summary that doesn't fit the schema)
+        """
+        # Convert the summary right away, so a bad row fails its config instead of the whole part on close
+        summary_df = get_summary_df(summary)
+        failed = summary_df['error'][0] is not None
+        if start_date_df is not None and not failed:
+            self.start_dates_writer.write_table(start_date_df.to_arrow())
+        self.summary_dfs.append(summary_df)
+        return failed
+
+    def close(self)->None:
+        # Rename the summary last, its presence marks the part as complete
+        self.start_dates_writer.close()
+        pl.concat(self.summary_dfs).write_parquet(f'{self.summary_path}.tmp')
+        os.replace(f'{self.start_dates_path}.tmp', self.start_dates_path)
+        os.replace(f'{self.summary_path}.tmp', self.summary_path)
+
+def run_batch(configs:list[dict], output_dir:str, part_size:int=100, verbose:bool=True)->dict:
+    """Run all configs not completed yet, writing their results to a new part every part_size configs
+
+    Only the current part's summary rows are kept in memory, so memory use doesn't grow with the number of
+    configs. An interruption loses at most the configs of the current part.
+
+    Returns:
+        dict: number of configs run, skipped (completed before) and failed
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    completed_config_ids = get_completed_config_ids(output_dir)
+    pending_configs = []
+    for config in configs:
+        config_id = get_config_id(config)
+        if config_id not in completed_config_ids:
+            completed_config_ids.add(config_id)
+            pending_configs.append(config)
+
+    counts = {'run':0, 'skipped':len(configs) - len(pending_configs), 'failed':0}
+    part_number = get_next_part_number(output_dir)
+    for start in range(0, len(pending_configs), part_size):
+        part_writer = PartWriter(output_dir, part_number)
+        for config in pending_configs[start:start+part_size]:
+            summary, start_date_df = run_config(config)
+            counts['run'] += 1
+            counts['failed'] += part_writer.write(summary, start_date_df)
+        part_writer.close()
+        part_number += 1
+        if verbose:
+            print(f'{counts["run"]}/{len(pending_configs)} configs done', file=sys.stderr)
+
+    return counts
+
+def main_cli(argv:list[str]=None)->int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('configs', help='JSON or CSV file with the strategy configs')
+    parser.add_argument('--output', required=True, help='output directory of the Parquet part files')
+    parser.add_argument('--part-size', type=int, default=100, help='configs per part file')
+    args = parser.parse_args(argv)
+
+    counts = run_batch(read_configs(args.configs), args.output, args.part_size)
+    print(f'Ran {counts["run"]} configs ({counts["failed"]} failed), skipped {counts["skipped"]} completed configs')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -0,0 +1,94 @@
+import numpy as np
+
+from config import BOOTSTRAP_BATCH_SIZE
+
+
+def get_block_sums(values:np.ndarray, block_length:int)->tuple[np.ndarray, np.ndarray]:
+    """Sums of all blocks of block_length consecutive values and of the shorter blocks closing a resample
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: sums of full blocks and of the last (partial) blocks, by block start
+    """
+    n_values = len(values)
+    n_last_values = n_values - (-(-n_values // block_length) - 1) * block_length
+    cumulative_sums = np.concatenate([[0.0], np.cumsum(values, dtype=np.float64)])
+    block_starts = np.arange(n_values - block_length + 1)
+    full_block_sums = cumulative_sums[block_starts + block_length] - cumulative_sums[block_starts]
+    last_block_sums = cumulative_sums[block_starts + n_last_values] - cumulative_sums[block_starts]
+    return full_block_sums, last_block_sums
+
+def block_bootstrap_means_from_block_sums(full_block_sums:np.ndarray, last_block_sums:np.ndarray, n_values:int,
+                                          n_resamples:int, block_length:int, seed:int=None, 
+                                          batch_size:int=None)->np.ndarray:
+    """Means of moving block bootstrap resamples of a series given by its block sums (see get_block_sums)
+
+    Args:
+        full_block_sums (np.ndarray): sums of the full blocks by block start
+        last_block_sums (np.ndarray): sums of the last (partial) blocks by block start
+        n_values (int): length of the series
+        n_resamples (int): number of resamples
+        block_length (int): number of consecutive values per block, at most the series length
+        seed (int, optional): seed of the random generator, for reproducible results
+        batch_size (int, optional): max block starts drawn at once to bound memory, defaults to all resamples at once
+
+    Returns:
+        np.ndarray: mean of every resample
+    """
+    n_blocks = -(-n_values // block_length)
+    resamples_per_batch = n_resamples if batch_size is None else max(1, batch_size // n_blocks)
+
+    # Draw the start of every block of a batch of resamples at once
+    rng = np.random.default_rng(seed)
+    resample_sums = []
+    for offset in range(0, n_resamples, resamples_per_batch):
+        block_starts = rng.integers(0, len(full_block_sums), size=(min(resamples_per_batch, n_resamples - offset), n_blocks), 
+                                    dtype=np.int32)
+        resample_sums.append(full_block_sums[block_starts[:, :-1]].sum(axis=1) + last_block_sums[block_starts[:, -1]])
+    return np.concatenate(resample_sums) / n_values
+
+def block_bootstrap_means(values:np.ndarray, n_resamples:int, block_length:int, seed:int=None,
+                          batch_size:int=BOOTSTRAP_BATCH_SIZE)->np.ndarray:
+    """Means of moving block bootstrap resamples of a series, drawn and summed as whole arrays
+
+    Each resample concatenates randomly chosen blocks of consecutive values until it has the length of the
+    series, keeping the autocorrelation of overlapping return windows within blocks. Means are built from
+    precomputed block sums, so the work is O(n_resamples * number of blocks) instead of O(n_resamples * n).
+
+    Args:
+        values (np.ndarray): series to resample, e.g. annualized returns per start date
+        n_resamples (int): number of resamples
+        block_length (int): number of consecutive values per block (at least 1), capped at the series length
+        seed (int, optional): seed of the random generator, for reproducible results
+        batch_size (int, optional): max block starts drawn at once to bound memory
+
+    Returns:
+        np.ndarray: mean of every resample
+    """
+    if block_length < 1:
+        raise ValueError('Bootstrap block length must be at least 1!')
+    n_values = len(values)
+    block_length = min(block_length, n_values)
+    full_block_sums, last_block_sums = get_block_sums(values, block_length)
+    return block_bootstrap_means_from_block_sums(full_block_sums, last_block_sums, n_values, n_resamples, block_length, 
+                                                 seed, batch_size)
+
+def get_mean_interval(resample_means:np.ndarray, confidence:float)->dict:
+    """Standard error and percentile confidence interval of the mean from the bootstrap resample means"""
+    tail = (1 - confidence) / 2
+    lower, upper = np.quantile(resample_means, [tail, 1 - tail])
+    return {'standard_error':float(resample_means.std(ddof=1)) if len(resample_means) > 1 else 0.0,
+            'lower':float(lower), 'upper':float(upper)}
+
+def bootstrap_mean_interval(values:np.ndarray, n_resamples:int, block_length:int, confidence:float,
+                            seed:int=None)->dict:
+    """Block bootstrap standard error and percentile confidence interval of the mean of a series
+
+    Returns:
+        dict: standard error and lower and upper bound of the interval, None if the series is empty
+    """
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return {'standard_error':None, 'lower':None, 'upper':None}
+
+    resample_means = block_bootstrap_means(values, n_resamples, block_length, seed)
+    return get_mean_interval(resample_means, confidence)
@@ -1,51 +1,286 @@
+import collections
+import contextlib
 import diskcache as dc
+import functools
 import hashlib
 import json
+import logging
+import threading
+import time
+import uuid
+from typing import Callable
 
-# Create a cache object (e.g., for a specific directory)
-cache = dc.Cache("cache")
+from config import (CACHE_DIR, CACHE_DISK_SIZE_LIMIT, CACHE_MEMORY_MAX_ENTRIES, CACHE_TTL_SECONDS, ENGINE_VERSION,
+                    SINGLE_FLIGHT_LEASE_SECONDS, SINGLE_FLIGHT_POLL_SECONDS, SINGLE_FLIGHT_WAIT_SECONDS)
+from src.instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+class ResultCache():
+    def __init__(self, directory:str=CACHE_DIR, memory_max_entries:int=CACHE_MEMORY_MAX_ENTRIES,
+                 disk_size_limit:int=CACHE_DISK_SIZE_LIMIT, ttl:float=CACHE_TTL_SECONDS) -> None:
+        """Two-tier cache: an in-process LRU dict in front of a size-bounded diskcache store
+
+        Args:
+            directory (str): directory of the disk tier
+            memory_max_entries (int): max entries kept in memory, least recently used are evicted first
+            disk_size_limit (int): max size of the disk tier in bytes, least recently stored are evicted first
+            ttl (float): seconds until an entry expires in both tiers, None to never expire
+        """
+        self.directory = directory
+        self.memory_max_entries = memory_max_entries
+        self.disk_size_limit = disk_size_limit
+        self.ttl = ttl
+        self.disk = dc.Cache(directory, size_limit=disk_size_limit)
+        self.memory = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self)->None:
+        self.stats = {'memory_hits':0, 'disk_hits':0, 'coalesced_hits':0, 'misses':0, 'hit_seconds':0.0, 
+                      'miss_seconds':0.0}
+
+    def get(self, key:str, default=None, count_hit:bool=True):
+        """Look up a key in memory first, then on disk (promoting disk hits to memory)
+
+        Args:
+            key (str): cache key
+            default (optional): returned if the key isn't cached
+            count_hit (bool): count a hit in the stats, False for internal lookups whose outcome is recorded otherwise
+        """
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                expire_time, value = entry
+                if expire_time is None or expire_time > time.time():
+                    self.memory.move_to_end(key)
+                    self.stats['memory_hits'] += count_hit
+                    return value
+                del self.memory[key]
+
+        value = self.disk.get(key, default=_MISSING)
+        if value is _MISSING:
+            return default
+        self._set_memory(key, value)
+        with self.lock:
+            self.stats['disk_hits'] += count_hit
+        return value
+
+    def set(self, key:str, value)->None:
+        self.disk.set(key, value, expire=self.ttl)
+        self._set_memory(key, value)
+
+    def _set_memory(self, key:str, value)->None:
+        expire_time = time.time() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.memory[key] = (expire_time, value)
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_max_entries:
+                self.memory.popitem(last=False)
+
+    def record(self, hit:bool, seconds:float, coalesced:bool=False)->None:
+        """Record the latency of a cached call, hits are counted by get already except coalesced ones (results
+        computed by a concurrent call with the same key, see single_flight)"""
+        with self.lock:
+            if hit:
+                self.stats['coalesced_hits'] += coalesced
+                self.stats['hit_seconds'] += seconds
+            else:
+                self.stats['misses'] += 1
+                self.stats['miss_seconds'] += seconds
+
+    def transact(self):
+        """Group several disk writes into one transaction"""
+        return self.disk.transact()
+
+    def get_stats(self)->dict:
+        with self.lock:
+            stats = dict(self.stats)
+            memory_entries = len(self.memory)
+        hits = stats['memory_hits'] + stats['disk_hits'] + stats['coalesced_hits']
+        calls = hits + stats['misses']
+        return {
+            'memory_hits':stats['memory_hits'],
+            'disk_hits':stats['disk_hits'],
+            'coalesced_hits':stats['coalesced_hits'],
+            'misses':stats['misses'],
+            'hit_rate':round(hits/calls, 4) if calls else 0.0,
+            'avg_hit_ms':round(stats['hit_seconds']/hits*1000, 3) if hits else 0.0,
+            'avg_miss_ms':round(stats['miss_seconds']/stats['misses']*1000, 3) if stats['misses'] else 0.0,
+            'memory_entries':memory_entries,
+            'disk_entries':len(self.disk),
+            'disk_bytes':self.disk.volume(),
+        }
+
+    def clear(self)->None:
+        with self.lock:
+            self.memory.clear()
+        self.disk.clear()
+
+    def close(self)->None:
+        self.disk.close()
+
+# Create the cache object shared by all cached functions
+cache = ResultCache()
+
+def configure_cache(**kwargs)->ResultCache:
+    """Replace the shared cache, e.g. to change its directory, size limits or TTL"""
+    global cache
+    cache.close()
+    cache = ResultCache(**kwargs)
+    return cache
+
+def reopen_cache()->ResultCache:
+    """Reopen the cache connection, needed in worker processes that inherited the parent's connection"""
+    return configure_cache(directory=cache.directory, memory_max_entries=cache.memory_max_entries,
+                           disk_size_limit=cache.disk_size_limit, ttl=cache.ttl)
+
+def get_cache_stats()->dict:
+    return cache.get_stats()
+
+# Keys computed by a thread of this process, other threads wait for their event instead of computing them again
+_flights = {}
+_flights_lock = threading.Lock()
+
+def _wait_until(done_func:Callable[[], bool], deadline:float, check_cancelled:Callable[[], None]=None)->bool:
+    """Poll done_func until it returns True, False once the deadline (of time.monotonic, None for none) passed"""
+    while not done_func():
+        if check_cancelled is not None:
+            check_cancelled()
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        time.sleep(SINGLE_FLIGHT_POLL_SECONDS)
+    return True
+
+@contextlib.contextmanager
+def _renewed_lease(lock_key:str, lease_seconds:float):
+    # Extend the lease of a lock in the background while the block runs, so only a crashed leader loses it
+    stop_event = threading.Event()
+    def renew():
+        while not stop_event.wait(lease_seconds / 3):
+            cache.disk.touch(lock_key, expire=lease_seconds)
+    renewal_thread = threading.Thread(target=renew, daemon=True, name='single_flight_lease')
+    renewal_thread.start()
+    try:
+        yield
+    finally:
+        stop_event.set()
+        renewal_thread.join()
+
+def _compute_and_store(key:str, compute_func:Callable)->tuple[object, bool]:
+    result = compute_func()
+    cache.set(key, result)
+    return result, True
+
+def _lead_across_processes(key:str, compute_func:Callable, lease_seconds:float, deadline:float,
+                           check_cancelled:Callable[[], None])->tuple[object, bool]:
+    # Compute the key while holding a lock in the disk tier, or wait for the process holding it
+    lock_key = f'single_flight:{key}'
+    token = uuid.uuid4().hex
+    while True:
+        result = cache.get(key, default=_MISSING, count_hit=False)
+        if result is not _MISSING:
+            return result, False
+        if cache.disk.add(lock_key, token, expire=lease_seconds):
+            try:
+                with _renewed_lease(lock_key, lease_seconds):
+                    return _compute_and_store(key, compute_func)
+            finally:
+                with cache.transact():
+                    if cache.disk.get(lock_key) == token:
+                        cache.disk.delete(lock_key)
+
+        # Another process computes the key, look for its result once it released the lock (or its lease expired)
+        if not _wait_until(lambda: lock_key not in cache.disk, deadline, check_cancelled):
+            logger.warning('Timed out waiting for the computation of %s in another process, computing it here', key)
+            return _compute_and_store(key, compute_func)
+
+def single_flight(key:str, compute_func:Callable, wait_timeout:float=SINGLE_FLIGHT_WAIT_SECONDS,
+                  lease_seconds:float=SINGLE_FLIGHT_LEASE_SECONDS, 
+                  check_cancelled:Callable[[], None]=None)->tuple[object, bool]:
+    """Compute and cache the result of a missed key once, even if several threads or processes miss it at once
+
+    The first caller of a key computes it while all others wait for its result in the cache. If the computation 
+    fails (or its process dies and the lease expires), the next waiting caller computes the key instead, its 
+    exception is only raised to its own caller.
+
+    Args:
+        key (str): cache key of the result
+        compute_func (Callable): computes the result without arguments, its result is stored under the key
+        wait_timeout (float): max seconds to wait for another computation before computing here, None to wait forever
+        lease_seconds (float): seconds until the lock of a computation expires if its process stops renewing it
+        check_cancelled (Callable[[], None], optional): called while waiting, raises to stop waiting
+
+    Returns:
+        tuple[object, bool]: result of compute_func and whether it was computed by this call (False if another 
+            caller computed it), its lookups aren't counted in the cache stats so callers can record one outcome
+    """
+    deadline = time.monotonic() + wait_timeout if wait_timeout is not None else None
+    while True:
+        with _flights_lock:
+            flight = _flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = _flights[key] = threading.Event()
+
+        if is_leader:
+            try:
+                return _lead_across_processes(key, compute_func, lease_seconds, deadline, check_cancelled)
+            finally:
+                with _flights_lock:
+                    del _flights[key]
+                flight.set()
+
+        # Wait for the thread computing the key, take over if it failed
+        if not _wait_until(flight.is_set, deadline, check_cancelled):
+            logger.warning('Timed out waiting for the computation of %s in another thread, computing it here', key)
+            return _compute_and_store(key, compute_func)
+        result = cache.get(key, default=_MISSING, count_hit=False)
+        if result is not _MISSING:
+            return result, False
 
 def hash_dict(d):
     """Generates a hash for a dictionary to use as a cache key."""
     dict_str = json.dumps(d, sort_keys=True)  # Convert dictionary to a sorted JSON string
     return hashlib.md5(dict_str.encode()).hexdigest()  # Return an MD5 hash of the string
 
-def disk_cached_write(func):
-    """Decorator to cache function results on disk based on the input dictionary."""
-    def wrapper(*args, **kwargs):
-        # Convert args to a key using a hash
-        if args or kwargs:
-            # Create a cache key from the args and kwargs (which could include the dict)
-            cache_key = hash_dict({"args": args, "kwargs": kwargs})
-        else:
-            cache_key = func.__name__  # If no args, use function name as a fallback
+def get_cache_key(func, args, kwargs, data_fingerprint=''):
+    """Generates the cache key for a function call, including the engine version and a fingerprint of the data used."""
+    return hash_dict({"func": func.__name__, "args": args, "kwargs": kwargs,
+                      "version": ENGINE_VERSION, "data": data_fingerprint})
 
-        # Try to retrieve the result from the cache
-        if cache_key in cache:
-            return cache[cache_key]
+def disk_cached_write(func=None, *, fingerprint_func=None):
+    """Decorator to cache function results in memory and on disk based on the input dictionary.
 
-        # If not cached, call the function and store the result
-        result = func(*args, **kwargs)
-        cache[cache_key] = result
-        return result
-    return wrapper
-    
-def disk_cached(func):
-    """Decorator to cache function results on disk based on the input dictionary."""
+    fingerprint_func is called with the same arguments and should return a fingerprint of the data
+    the result depends on, so results are recomputed when the data changes. Concurrent calls with the
+    same key are computed once (see single_flight).
+    """
+    if func is None:
+        return functools.partial(disk_cached_write, fingerprint_func=fingerprint_func)
+
+    def cache_key(*args, **kwargs):
+        data_fingerprint = fingerprint_func(*args, **kwargs) if fingerprint_func else ''
+        return get_cache_key(func, args, kwargs, data_fingerprint)
+
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        # Convert args to a key using a hash
-        if args or kwargs:
-            # Create a cache key from the args and kwargs (which could include the dict)
-            cache_key = hash_dict({"args": args, "kwargs": kwargs})
-        else:
-            cache_key = func.__name__  # If no args, use function name as a fallback
+        start_time = time.perf_counter()
+        key = cache_key(*args, **kwargs)
 
         # Try to retrieve the result from the cache
-        if cache_key in cache:
-            return cache[cache_key]
+        with stage('cache_lookup'):
+            result = cache.get(key, default=_MISSING)
+        if result is not _MISSING:
+            cache.record(hit=True, seconds=time.perf_counter() - start_time)
+            return result
 
-        # If not cached, call the function
-        result = func(*args, **kwargs)
+        # If not cached, call the function (or wait for a running call with the same key) and store the result
+        result, computed = single_flight(key, lambda: func(*args, **kwargs))
+        cache.record(hit=not computed, seconds=time.perf_counter() - start_time, coalesced=not computed)
         return result
-    
-    return wrapper
\ No newline at end of file
+
+    wrapper.cache_key = cache_key
+    return wrapper
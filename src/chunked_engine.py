@@ -0,0 +1,325 @@
+"""Chunked strategy engine for histories too long to process in memory at once, e.g. decades of minute bars.
+
+Runs the down percent, max months and cost average logic of main.run on the memory-mapped columns of the quote
+store (see quote_store.load_quote_columns), processing start rows in chunks sized to a memory budget:
+    1. Backward pass: first crossing row per start row. Crossings after a chunk can only be at the record lows
+       after the chunk (prices lower than all prices between the chunk and them), these are the only state carried
+       from chunk to chunk.
+    2. Forward pass: investment and end dates, returns and streaming summary statistics per chunk.
+Per start row intermediate results are kept in temp files, so memory doesn't grow with the length of the history.
+On daily quotes the results equal the results of main.run.
+"""
+import datetime
+import os
+import tempfile
+
+import numpy as np
+
+from config import BOOTSTRAP_CONFIDENCE, CHUNKED_MEMORY_BUDGET_BYTES
+from src import bootstrap, main, quote_store, strategy_engine, utils
+from src.caching import disk_cached_write
+from src.instrumentation import timed
+
+# Number of 8 byte work arrays per start row of a chunk, besides the range-minimum table of the chunk
+CHUNK_ARRAYS_PER_ROW = 40
+
+
+def get_chunk_rows(memory_budget_bytes:int)->int:
+    """Start rows per chunk so the work arrays and the range-minimum table (one level per power of two) of a chunk
+    fit into the memory budget"""
+    chunk_rows = max(1, memory_budget_bytes // (8*CHUNK_ARRAYS_PER_ROW))
+    while chunk_rows > 1 and 8*chunk_rows*(CHUNK_ARRAYS_PER_ROW + chunk_rows.bit_length()) > memory_budget_bytes:
+        chunk_rows //= 2
+    return chunk_rows
+
+def get_chunks(n_rows:int, chunk_rows:int)->list[tuple[int, int]]:
+    return [(start, min(start + chunk_rows, n_rows)) for start in range(0, n_rows, chunk_rows)]
+
+def get_window_rows(times:np.ndarray, units_per_day:int, min_year:int, max_year:int)->tuple[int, int]:
+    """First and last (exclusive) row of the times in the years min_year to max_year"""
+    window_start = (datetime.date(min_year, 1, 1) - utils.EPOCH).days * units_per_day
+    window_end = (datetime.date(max_year + 1, 1, 1) - utils.EPOCH).days * units_per_day
+    return int(np.searchsorted(times, window_start)), int(np.searchsorted(times, window_end))
+
+def round_returns(returns:np.ndarray)->np.ndarray:
+    """Round to 2 decimals like polars, ties away from zero"""
+    scaled_returns = returns * 100
+    rounded_returns = np.round(scaled_returns)
+    is_tie = np.abs(scaled_returns - np.trunc(scaled_returns)) == 0.5
+    return np.where(is_tie, np.trunc(scaled_returns) + np.sign(scaled_returns), rounded_returns) / 100
+
+def search_times(times:np.ndarray, values:np.ndarray)->np.ndarray:
+    """np.searchsorted(times, values) only searching the rows between the smallest and largest value, so only these
+    pages of memory-mapped times are loaded"""
+    if len(values) == 0:
+        return np.empty(0, dtype=np.int64)
+    first, last = np.searchsorted(times, values.min()), np.searchsorted(times, values.max(), side='right')
+    return first + np.searchsorted(times[first:last], values)
+
+def write_crossing_rows(close:np.ndarray, percent:int, crossing_rows_path:str, chunk_rows:int)->None:
+    """Write the first crossing row of every start row (-1 if the price never crosses) as int64 file, equal to
+    strategy_engine.first_crossing_rows(close, percent) but computed chunk by chunk from the last chunk backwards"""
+    # Record lows after the current chunk: increasing rows with strictly decreasing closes
+    record_rows = np.empty(0, dtype=np.int64)
+    record_close = np.empty(0, dtype=np.float64)
+    with open(crossing_rows_path, 'wb') as f:
+        f.truncate(8*len(close))
+        for start, stop in reversed(get_chunks(len(close), chunk_rows)):
+            chunk_close = np.array(close[start:stop])
+            thresholds = chunk_close - (percent/100)*chunk_close
+            rows = strategy_engine.first_crossing_indices(chunk_close, thresholds)
+
+            # Without a crossing in the chunk, the first crossing is the first later record low at or below the threshold
+            has_crossing = rows >= 0
+            later_records = np.searchsorted(-record_close, -thresholds[~has_crossing], side='left')
+            crossing_rows = np.empty(len(rows), dtype=np.int64)
+            crossing_rows[has_crossing] = rows[has_crossing] + start
+            crossing_rows[~has_crossing] = np.append(record_rows, -1)[later_records]
+            f.seek(8*start)
+            f.write(crossing_rows.tobytes())
+
+            # Record lows of the chunk, followed by the later record lows below all closes of the chunk
+            running_min = np.minimum.accumulate(chunk_close)
+            is_record = np.concatenate([[True], chunk_close[1:] < running_min[:-1]])
+            is_later_record = record_close < running_min[-1]
+            record_rows = np.concatenate([np.flatnonzero(is_record) + start, record_rows[is_later_record]])
+            record_close = np.concatenate([chunk_close[is_record], record_close[is_later_record]])
+            quote_store.release_mapped_pages(close)
+
+def get_tranche_returns(times:np.ndarray, close:np.ndarray, investment_times:np.ndarray, end_times:np.ndarray,
+                        end_price:np.ndarray, schedule_dict:dict, units_per_day:int)->np.ndarray:
+    """Total return per start row combined over the tranches of the Cost Average Strategy, NaN if no tranche is
+    before the end date (same as main.add_cost_average_strategy_dates and main.build_total_return_query)"""
+    return_sums = np.zeros(len(investment_times))
+    weighted_return_sums = np.zeros(len(investment_times))
+    weight_sums = np.zeros(len(investment_times))
+    tranche_counts = np.zeros(len(investment_times), dtype=np.int64)
+    for day_offset, weight in zip(schedule_dict['day_offset'], schedule_dict['weight']):
+        # Next trading time on or after each tranche time, only keeping tranches until the end date
+        tranche_times = investment_times + day_offset*units_per_day
+        has_tranche = tranche_times <= end_times
+        tranche_rows = np.minimum(search_times(times, tranche_times), len(times)-1)
+        tranche_returns = round_returns((end_price / close[tranche_rows] - 1)*100)
+        return_sums += np.where(has_tranche, tranche_returns, 0.0)
+        weighted_return_sums += np.where(has_tranche, tranche_returns*weight, 0.0)
+        weight_sums += np.where(has_tranche, weight, 0.0)
+        tranche_counts += has_tranche
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if len(set(schedule_dict['weight'])) == 1:
+            return np.where(tranche_counts > 0, return_sums / tranche_counts, np.nan)
+        return np.where(weight_sums > 0, weighted_return_sums / weight_sums, np.nan)
+
+def get_chunk_results(times:np.ndarray, close:np.ndarray, crossing_rows:np.ndarray, start:int, stop:int,
+                      strategy_dict:dict, schedule_dict:dict, units_per_day:int)->dict[str, np.ndarray]:
+    """Per start row results of the start rows start to stop, dropping start rows without an end date or whose
+    (capped) investment date isn't a trading date, like the joins of main.build_total_return_query
+
+    Returns:
+        dict[str, np.ndarray]: annualized_return (NaN if missing), days_waited_to_invest and not_invested per start row
+    """
+    n_rows = len(times)
+    start_times = np.array(times[start:stop])
+
+    # End date: next trading time on or after start + n*365 days, last time without investment horizon
+    if strategy_dict['investment_horizon'] != 0:
+        end_rows = search_times(times, start_times + strategy_dict['investment_horizon']*365*units_per_day)
+    else:
+        end_rows = np.full(len(start_times), n_rows-1)
+    has_end = end_rows < n_rows
+    start_times, end_rows, crossing_rows = start_times[has_end], end_rows[has_end], crossing_rows[has_end]
+    end_times = times[end_rows]
+
+    # Investment date: first crossing, else the end date, capped to start + n months
+    investment_times = np.where(crossing_rows >= 0, times[np.maximum(crossing_rows, 0)], end_times)
+    investment_times = strategy_engine.cap_buy_days(start_times, investment_times, strategy_dict['months'], units_per_day)
+    investment_rows = np.minimum(search_times(times, investment_times), n_rows-1)
+    is_trading_time = times[investment_rows] == investment_times
+    start_times, end_rows, end_times = start_times[is_trading_time], end_rows[is_trading_time], end_times[is_trading_time]
+    investment_rows, investment_times = investment_rows[is_trading_time], investment_times[is_trading_time]
+
+    # Total return, combined over the tranches of the Cost Average Strategy
+    end_price = close[end_rows]
+    if schedule_dict is None:
+        total_return = round_returns((end_price / close[investment_rows] - 1)*100)
+    else:
+        total_return = get_tranche_returns(times, close, investment_times, end_times, end_price, schedule_dict,
+                                           units_per_day)
+
+    # Whole days waited and invested (truncated like polars total_days) and annualized return
+    waited = investment_times - start_times
+    invested = end_times - investment_times
+    days_waited = np.sign(waited) * (np.abs(waited) // units_per_day)
+    days_invested = np.sign(invested) * (np.abs(invested) // units_per_day)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        annualized_return = round_returns(((1 + total_return/100) ** (365/days_invested) - 1)*100)
+
+    return {'annualized_return':annualized_return, 'days_waited_to_invest':days_waited,
+            'not_invested':end_times == investment_times}
+
+class StreamingStatistics():
+    def __init__(self, returns_path:str) -> None:
+        """Summary statistics of main.calculate_result_dict, updated chunk by chunk. Returns are rounded to cents,
+        so exact quantiles are kept as counts per distinct return, and returns are written to a file for the bootstrap
+
+        Args:
+            returns_path (str): file the returns (without missing returns) are appended to
+        """
+        self.returns_path = returns_path
+        self.returns_file = open(returns_path, 'wb')
+        self.return_keys = np.empty(0, dtype=np.int64)
+        self.return_counts = np.empty(0, dtype=np.int64)
+        self.n_dates = 0
+        self.n_not_invested = 0
+        self.days_waited_sum = 0
+
+    def update(self, chunk_results:dict[str, np.ndarray])->None:
+        annualized_return = chunk_results['annualized_return']
+        annualized_return = annualized_return[~np.isnan(annualized_return)]
+        self.returns_file.write(annualized_return.tobytes())
+        self.n_dates += len(chunk_results['not_invested'])
+        self.n_not_invested += int(chunk_results['not_invested'].sum())
+        self.days_waited_sum += int(chunk_results['days_waited_to_invest'].sum())
+
+        # Merge the counts per return in cents
+        keys, inverse = np.unique(np.concatenate([self.return_keys, np.rint(annualized_return*100).astype(np.int64)]),
+                                  return_inverse=True)
+        self.return_counts = np.bincount(inverse, weights=np.concatenate([self.return_counts,
+                                                                          np.ones(len(annualized_return), dtype=np.int64)]),
+                                         minlength=len(keys)).astype(np.int64)
+        self.return_keys = keys
+
+    def get_quantile(self, quantile:float)->float:
+        # Nearest rank like polars quantile with the default interpolation
+        n_returns = int(self.return_counts.sum())
+        rank = int(np.floor((n_returns - 1)*quantile + 0.5))
+        return float(self.return_keys[np.searchsorted(np.cumsum(self.return_counts), rank, side='right')] / 100)
+
+    def to_result_dict(self, n_resamples:int, block_length:int, seed:int, memory_budget_bytes:int)->dict:
+        """Result dict as returned by main.calculate_result_dict"""
+        self.returns_file.close()
+        if self.n_dates == 0 or self.return_counts.sum() == 0:
+            raise ValueError('No returns in the selected period, please adjust!')
+
+        # Mean and standard deviation from exact integer sums of the returns in cents
+        keys, counts = [int(key) for key in self.return_keys], [int(count) for count in self.return_counts]
+        n_returns = sum(counts)
+        key_sum = sum(key*count for key, count in zip(keys, counts))
+        key_square_sum = sum(key*key*count for key, count in zip(keys, counts))
+        std = (((n_returns*key_square_sum - key_sum**2) / (n_returns*(n_returns - 1)))**0.5 / 100
+               if n_returns > 1 else float('nan'))
+
+        average_return_interval = get_bootstrap_interval(self.returns_path, n_returns, n_resamples, block_length, seed,
+                                                         memory_budget_bytes)
+        return {
+            'average_annualized_return':round(key_sum / n_returns / 100, 2),
+            'average_days_waited':int(round(self.days_waited_sum / self.n_dates, 0)),
+            'perc_not_invested':main.get_non_invested_percentage(self.n_not_invested, self.n_dates),
+            'bottom_pctile':round(self.get_quantile(0.05), 2),
+            'top_pctile':round(self.get_quantile(0.95), 2),
+            'std':round(std, 2),
+            'min':round(keys[0] / 100, 2),
+            'max':round(keys[-1] / 100, 2),
+            'average_return_se':round(average_return_interval['standard_error'], 2),
+            'average_return_bottom':round(average_return_interval['lower'], 2),
+            'average_return_top':round(average_return_interval['upper'], 2),
+        }
+
+def get_cumulative_sums_at(values_path:str, n_values:int, rows:np.ndarray, chunk_rows:int)->np.ndarray:
+    """Sums of the first rows (sorted) values of a float64 file, streamed chunk by chunk with the same result as 
+    np.cumsum of all values"""
+    cumulative_sums = np.zeros(len(rows))
+    cumulative_sum = np.zeros(1)
+    for offset in range(0, n_values, chunk_rows):
+        values = np.fromfile(values_path, dtype=np.float64, count=min(chunk_rows, n_values - offset), offset=8*offset)
+
+        # Continue the sum of the previous chunks, chunk_sums[i] is the sum of the first offset + i values
+        chunk_sums = np.cumsum(np.concatenate([cumulative_sum, values]))
+        first, last = np.searchsorted(rows, offset), np.searchsorted(rows, offset + len(values), side='right')
+        cumulative_sums[first:last] = chunk_sums[rows[first:last] - offset]
+        cumulative_sum = chunk_sums[-1:]
+    return cumulative_sums
+
+def get_bootstrap_interval(returns_path:str, n_returns:int, n_resamples:int, block_length:int, seed:int,
+                           memory_budget_bytes:int)->dict:
+    """Block bootstrap interval of the average return from the returns file, equal to bootstrap.bootstrap_mean_interval
+    unless the block sums of all block starts don't fit into half of the memory budget, then only every n-th block 
+    start is drawn from"""
+    block_length = max(1, min(block_length, n_returns))
+    n_blocks = -(-n_returns // block_length)
+    n_last_values = n_returns - (n_blocks - 1)*block_length
+    n_block_starts = n_returns - block_length + 1
+
+    # About 64 bytes per block start to determine the block sums, reading about 24 bytes per value of a chunk
+    block_start_step = max(1, -(-128*n_block_starts // memory_budget_bytes))
+    block_starts = np.arange(0, n_block_starts, block_start_step)
+    chunk_rows = max(1, memory_budget_bytes // 64)
+    start_sums = get_cumulative_sums_at(returns_path, n_returns, block_starts, chunk_rows)
+    full_block_sums = get_cumulative_sums_at(returns_path, n_returns, block_starts + block_length, chunk_rows) - start_sums
+    last_block_sums = get_cumulative_sums_at(returns_path, n_returns, block_starts + n_last_values, chunk_rows) - start_sums
+    del block_starts, start_sums
+
+    # Block starts (also converted to int64 for indexing) and gathered block sums take about 32 bytes per drawn block
+    resample_means = bootstrap.block_bootstrap_means_from_block_sums(
+        full_block_sums, last_block_sums, n_returns, n_resamples, block_length, seed,
+        batch_size=max(1, memory_budget_bytes // 64))
+    return bootstrap.get_mean_interval(resample_means, BOOTSTRAP_CONFIDENCE)
+
+def get_schedule_dict(strategy_dict:dict)->dict:
+    cost_average_schedule = main.get_cost_average_schedule(strategy_dict)
+    return cost_average_schedule.to_dict(as_series=False) if cost_average_schedule is not None else None
+
+def run_on_columns(times:np.ndarray, close:np.ndarray, units_per_day:int, strategy_dict:dict,
+                   memory_budget_bytes:int=CHUNKED_MEMORY_BUDGET_BYTES, chunk_rows:int=None)->dict:
+    """Summary statistics of a strategy on (memory-mapped) quote columns, processing start rows in chunks
+
+    Args:
+        times (np.ndarray): sorted, unique int64 times since epoch
+        close (np.ndarray): normalized close per time
+        units_per_day (int): time units per day, 1 for epoch days
+        strategy_dict (dict): strategy dict as accepted by main.run (include_distribution is ignored)
+        memory_budget_bytes (int): max memory of the work arrays of a chunk and a bootstrap batch
+        chunk_rows (int, optional): start rows per chunk, derived from the memory budget by default
+
+    Returns:
+        dict: same result dict as main.run
+    """
+    first_row, last_row = get_window_rows(times, units_per_day, strategy_dict['min_year'], strategy_dict['max_year'])
+    times, close = times[first_row:last_row], close[first_row:last_row]
+    investment_horizon = strategy_dict['investment_horizon']
+    if len(times) == 0 or times[0] + investment_horizon*365*units_per_day > times[-1]:
+        raise ValueError(f'Investment horizon larger than selected period, please adjust!')
+    chunk_rows = chunk_rows or get_chunk_rows(memory_budget_bytes)
+    schedule_dict = get_schedule_dict(strategy_dict)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        crossing_rows_path = os.path.join(temp_dir, 'crossing_rows')
+        returns_path = os.path.join(temp_dir, 'returns')
+        write_crossing_rows(close, strategy_dict['percent'], crossing_rows_path, chunk_rows)
+
+        statistics = StreamingStatistics(returns_path)
+        last_time = None
+        for start, stop in get_chunks(len(times), chunk_rows):
+            chunk_times = np.array(times[start:stop])
+            if (np.diff(chunk_times) <= 0).any() or (last_time is not None and chunk_times[0] <= last_time):
+                raise ValueError('Quote times must be sorted and unique!')
+            last_time = chunk_times[-1]
+
+            crossing_rows = np.fromfile(crossing_rows_path, dtype=np.int64, count=stop-start, offset=8*start)
+            statistics.update(get_chunk_results(times, close, crossing_rows, start, stop, strategy_dict, schedule_dict,
+                                                units_per_day))
+            quote_store.release_mapped_pages(times)
+            quote_store.release_mapped_pages(close)
+
+        return statistics.to_result_dict(**main.get_bootstrap_options(strategy_dict), memory_budget_bytes=memory_budget_bytes)
+
+def get_chunked_fingerprint(strategy_dict:dict, memory_budget_bytes:int=None)->str:
+    return main.get_quote_data_fingerprint(strategy_dict)
+
+@disk_cached_write(fingerprint_func=get_chunked_fingerprint)
+@timed
+def run_chunked(strategy_dict:dict, memory_budget_bytes:int=CHUNKED_MEMORY_BUDGET_BYTES)->dict:
+    """Summary statistics of a strategy like main.run, on the memory-mapped quote columns of the index processed in
+    chunks, so memory stays within the budget for any length of history (e.g. intraday quotes)"""
+    times, close, units_per_day = main.import_quote_columns(strategy_dict['index'])
+    return run_on_columns(times, close, units_per_day, strategy_dict, memory_budget_bytes)
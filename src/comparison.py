@@ -0,0 +1,106 @@
+import functools
+
+import numpy as np
+import polars as pl
+
+from src import main, strategy_engine
+from src.caching import disk_cached_write
+from src.instrumentation import timed
+from src.trading_calendar import TradingCalendar
+
+# Metrics of main.run shown side by side, null for indices without results in the period
+COMPARISON_METRICS = ['average_annualized_return', 'average_return_bottom', 'average_return_top', 'average_days_waited',
+                      'perc_not_invested', 'bottom_pctile', 'top_pctile', 'std', 'min', 'max']
+
+def get_indices(indices:list[str]=None)->list[str]:
+    return list(indices) if indices else list(main.INDEX_FILE_MAPPING)
+
+def get_comparison_fingerprint(strategy_dict:dict, indices:list[str]=None, include_bootstrap:bool=False)->str:
+    return '-'.join(main.get_quote_data_fingerprint({**strategy_dict, 'index':index}) for index in get_indices(indices))
+
+@functools.lru_cache(maxsize=8)
+@timed
+def _load_aligned_quotes(indices:tuple[str], data_fingerprint:str)->pl.DataFrame:
+    """Closes of several indices on the union of their trading dates, forward filled on days an index didn't trade
+
+    Returns:
+        pl.DataFrame: Date and one close column per index, null before the first quote of an index
+    """
+    quotes_dfs = [main.import_historical_quote_data(index).select(['Date', pl.col('Close').alias(index)])
+                  .unique(subset='Date', keep='first').sort(by='Date')
+                  for index in indices]
+    aligned_df = pl.concat([quotes_df.select('Date') for quotes_df in quotes_dfs]).unique().sort(by='Date')
+    for quotes_df in quotes_dfs:
+        aligned_df = aligned_df.join(quotes_df, on='Date', how='left')
+
+    return aligned_df.with_columns(pl.col(list(indices)).forward_fill())
+
+def load_aligned_quotes(indices:list[str]=None)->pl.DataFrame:
+    indices = tuple(get_indices(indices))
+    data_fingerprint = '-'.join(main.get_full_history_fingerprint(index) for index in indices)
+    return _load_aligned_quotes(indices, data_fingerprint)
+
+def get_index_strategy_dates(calendar:TradingCalendar, close:np.ndarray, end_rows:np.ndarray,
+                             strategy_dict:dict)->pl.DataFrame:
+    """Strategy dates of one index on the shared calendar, only for start dates from the first quote of the index"""
+    first_row = int(np.argmax(~np.isnan(close)))
+    buy_rows = np.full(calendar.n_rows, -1, dtype=np.int64)
+    index_buy_rows = strategy_engine.first_crossing_rows(close[first_row:], strategy_dict['percent'])
+    buy_rows[first_row:] = np.where(index_buy_rows >= 0, index_buy_rows + first_row, -1)
+    strategy_dates_df = main.create_strategy_result_df(calendar, buy_rows, end_rows, strategy_dict['months'])
+
+    return strategy_dates_df.filter(pl.col('start_date') >= pl.lit(calendar.day_numbers[first_row]).cast(pl.Date))
+
+@disk_cached_write(fingerprint_func=get_comparison_fingerprint)
+@timed
+def run_comparison(strategy_dict:dict, indices:list[str]=None, include_bootstrap:bool=False)->pl.DataFrame:
+    """Run the same strategy on several indices at once, sharing one aligned quote frame and trading calendar
+
+    All indices are evaluated on the union of their trading dates with forward filled closes, so every index is
+    compared on the same start, investment and end dates. Results can therefore differ slightly from main.run,
+    which only uses the trading dates of the index itself.
+
+    Args:
+        strategy_dict (dict): strategy dict as accepted by main.run, without index
+        indices (list[str], optional): indices to compare, defaults to all available indices
+        include_bootstrap (bool): compute the bootstrap interval of the average return, null otherwise
+
+    Returns:
+        pl.DataFrame: one row per index with the metrics of main.run, null if the index has no results in the period
+    """
+    indices = get_indices(indices)
+    aligned_df = main.filter_quotes_by_year(load_aligned_quotes(indices), strategy_dict['min_year'],
+                                            strategy_dict['max_year'])
+
+    # Date handling shared by all indices
+    calendar = TradingCalendar.from_df(aligned_df)
+    end_rows = main.get_end_rows(calendar, strategy_dict['investment_horizon'])
+
+    # Build the return queries of all indices with results in the period
+    queries = {}
+    for index in indices:
+        close = aligned_df[index].fill_null(float('nan')).to_numpy()
+        if np.isnan(close).all():
+            continue
+        strategy_dates_df = get_index_strategy_dates(calendar, close, end_rows, strategy_dict)
+        if not strategy_dates_df.is_empty():
+            quotes_df = aligned_df.select(['Date', pl.col(index).alias('Close')]).drop_nulls()
+            queries[index] = main.build_total_return_query(quotes_df.lazy(), strategy_dates_df.lazy(),
+                                                           {**strategy_dict, 'index':index})
+
+    # Run the queries of all indices in parallel
+    strategy_result_dfs = dict(zip(queries, pl.collect_all(list(queries.values()))))
+    result_dicts = []
+    for index in indices:
+        result_dict = {'index':index}
+        if index in strategy_result_dfs:
+            result_dict.update(main.calculate_result_dict(strategy_result_dfs[index],
+                                                          **main.get_bootstrap_options(strategy_dict),
+                                                          include_bootstrap=include_bootstrap))
+        result_dicts.append(result_dict)
+
+    comparison_df = pl.from_dicts(result_dicts, infer_schema_length=None)
+
+    return comparison_df.select(['index', *[pl.col(metric) if metric in comparison_df.columns
+                                            else pl.lit(None, dtype=pl.Float64).alias(metric)
+                                            for metric in COMPARISON_METRICS]])
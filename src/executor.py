@@ -0,0 +1,70 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from src import caching, main
+
+
+def _init_worker()->None:
+    # Don't share the parent's SQLite connection to the cache across processes
+    caching.reopen_cache()
+
+def _run_chunk(chunk:list[tuple[int, dict]])->list[dict]:
+    """Run a chunk of strategy dicts in a worker, reading from but never writing to the shared cache"""
+    uncached_run = main.run.__wrapped__
+    task_results = []
+    for position, strategy_dict in chunk:
+        task_result = {'position':position, 'strategy_dict':strategy_dict, 'result_dict':None,
+                       'error':None, 'from_cache':False}
+        try:
+            task_result['result_dict'] = caching.cache.get(main.run.cache_key(strategy_dict))
+            if task_result['result_dict'] is not None:
+                task_result['from_cache'] = True
+            else:
+                task_result['result_dict'] = uncached_run(strategy_dict)
+        except Exception as e:
+            # Capture errors per task so one failing config doesn't abort the whole batch
+            task_result['error'] = f'{type(e).__name__}: {e}'
+        task_results.append(task_result)
+    return task_results
+
+def split_into_chunks(items:list, chunksize:int)->list[list]:
+    return [items[i:i+chunksize] for i in range(0, len(items), chunksize)]
+
+def run_many(strategy_dicts:list[dict], max_workers:int=None, chunksize:int=None)->list[dict]:
+    """Run independent main.run workloads (e.g. several indices x configs) on a process pool
+
+    Workers only read from the shared disk cache; new results are written by the calling process
+    in a single transaction, so there is one writer and no lock contention between workers.
+
+    Args:
+        strategy_dicts (list[dict]): strategy dicts as accepted by main.run
+        max_workers (int, optional): number of worker processes, defaults to the number of CPUs
+        chunksize (int, optional): strategy dicts per task, defaults to ~4 tasks per worker
+
+    Returns:
+        list[dict]: one dict per strategy dict in input order with the keys strategy_dict,
+            result_dict, error (None if successful) and from_cache
+    """
+    if not strategy_dicts:
+        return []
+    max_workers = max_workers or os.cpu_count() or 1
+    chunksize = chunksize or max(1, math.ceil(len(strategy_dicts) / (max_workers*4)))
+    chunks = split_into_chunks(list(enumerate(strategy_dicts)), chunksize)
+
+    # Run chunks in parallel, results are collected in submission order
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(chunks)), initializer=_init_worker) as pool:
+        chunk_results = list(pool.map(_run_chunk, chunks))
+    task_results = sorted((task_result for chunk_result in chunk_results for task_result in chunk_result),
+                          key=lambda task_result: task_result['position'])
+
+    # Store newly computed results in the shared cache
+    with caching.cache.transact():
+        for task_result in task_results:
+            if task_result['error'] is None and not task_result['from_cache']:
+                caching.cache.set(main.run.cache_key(task_result['strategy_dict']), task_result['result_dict'])
+
+    for task_result in task_results:
+        del task_result['position']
+
+    return task_results
@@ -0,0 +1,144 @@
+import contextlib
+import functools
+import logging
+import threading
+import time
+import tracemalloc
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# Collector of the current thread, stages are only recorded while one is active
+_local = threading.local()
+_sinks = []
+
+class StageRecord():
+    __slots__ = ('name', 'depth', 'seconds', 'rows', 'allocated_bytes')
+
+    def __init__(self, name:str, depth:int) -> None:
+        self.name = name
+        self.depth = depth
+        self.seconds = 0.0
+        self.rows = None
+        self.allocated_bytes = None
+
+    def to_dict(self)->dict:
+        return {'stage':self.name, 'depth':self.depth, 'ms':round(self.seconds*1000, 3),
+                'rows':self.rows, 'allocated_bytes':self.allocated_bytes}
+
+# Shared record handed out while instrumentation is off, so callers can set rows unconditionally
+_NULL_RECORD = StageRecord('', 0)
+
+class TimingCollector():
+    def __init__(self, track_allocations:bool=False) -> None:
+        self.track_allocations = track_allocations
+        self.records = []
+        self.depth = 0
+
+    def to_dicts(self)->list[dict]:
+        return [record.to_dict() for record in self.records]
+
+@contextlib.contextmanager
+def stage(name:str):
+    """Record wall time (and allocations if tracked) of a block as stage of the active collector, no-op if none is active
+
+    Usage:
+        with stage('get_strategy_results') as record:
+            df = ...
+            record.rows = len(df)
+    """
+    collector = getattr(_local, 'collector', None)
+    if collector is None:
+        yield _NULL_RECORD
+        return
+
+    record = StageRecord(name, collector.depth)
+    collector.records.append(record)
+    collector.depth += 1
+    track_allocations = collector.track_allocations and tracemalloc.is_tracing()
+    if track_allocations:
+        start_bytes = tracemalloc.get_traced_memory()[0]
+    start_time = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.seconds = time.perf_counter() - start_time
+        if track_allocations:
+            record.allocated_bytes = tracemalloc.get_traced_memory()[0] - start_bytes
+        collector.depth -= 1
+
+def timed(func=None, *, name:str=None):
+    """Decorator recording every call of a function as stage, with the row count if it returns a df"""
+    if func is None:
+        return functools.partial(timed, name=name)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Keep the overhead to one attribute lookup while instrumentation is off
+        if getattr(_local, 'collector', None) is None:
+            return func(*args, **kwargs)
+        with stage(name or func.__name__) as record:
+            result = func(*args, **kwargs)
+            record.rows = getattr(result, 'height', None)
+            return result
+    return wrapper
+
+@contextlib.contextmanager
+def collect_timings(track_allocations:bool=False):
+    """Activate stage recording for the current thread and pass the timings to all sinks afterwards
+
+    Args:
+        track_allocations (bool): also record net Python allocations per stage (uses tracemalloc, slow)
+
+    Yields:
+        TimingCollector: collector holding the stage records
+    """
+    collector = TimingCollector(track_allocations)
+    previous_collector = getattr(_local, 'collector', None)
+    started_tracing = track_allocations and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _local.collector = collector
+    try:
+        yield collector
+    finally:
+        _local.collector = previous_collector
+        if started_tracing:
+            tracemalloc.stop()
+        timings = collector.to_dicts()
+        for sink in list(_sinks):
+            try:
+                sink(timings)
+            except Exception:
+                logger.exception('Timing sink failed')
+
+def add_timing_sink(sink:Callable[[list[dict]], None])->None:
+    """Register a function that receives the stage timings of every collection, e.g. to export them to a log"""
+    _sinks.append(sink)
+
+def remove_timing_sink(sink:Callable[[list[dict]], None])->None:
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+def log_sink(timings:list[dict])->None:
+    """Timing sink writing one log line per stage"""
+    for timing in timings:
+        logger.info('%s%s: %.3f ms, rows=%s, allocated_bytes=%s', '  '*timing['depth'], timing['stage'],
+                    timing['ms'], timing['rows'], timing['allocated_bytes'])
+
+# Import and render times of the app script runs of this process, the first one is the cold start
+_render_timings = []
+
+def record_render(import_seconds:float, render_seconds:float)->None:
+    """Record the import time and the time to render of an app script run, logging the cold start of the process
+
+    Args:
+        import_seconds (float): time spent importing modules at the start of the script run
+        render_seconds (float): time from the start of the script run until the page was rendered
+    """
+    if not _render_timings:
+        logger.info('Cold start: imports %.3f s, first render %.3f s', import_seconds, render_seconds)
+    _render_timings.append({'import_s':import_seconds, 'render_s':render_seconds})
+
+def get_render_timings()->list[dict]:
+    return list(_render_timings)
@@ -1,40 +1,84 @@
-import bisect
-import datetime
+import collections
+import functools
+import io
+import itertools
+import json
+import threading
+from typing import Callable
+import numpy as np
 import polars as pl
-import streamlit as st
 
-from config import THOUSAND_SEP, DATE_FORMAT, DATE_SEP, MONTH_DAYS
-from db import db_funcs
-from src import utils
+from config import (THOUSAND_SEP, DATE_FORMAT, DATETIME_FORMAT, DATE_SEP, MONTH_DAYS, FULL_HISTORY_CACHE_SIZE, BOOTSTRAP_RESAMPLES, 
+                    BOOTSTRAP_BLOCK_LENGTH, BOOTSTRAP_SEED, BOOTSTRAP_CONFIDENCE, RUN_CHUNK_SIZE, 
+                    PERCENT_OPTIONS, CHART_MAX_POINTS, CHART_CACHE_SIZE, DISTRIBUTION_BINS)
+from src import bootstrap, quote_store, strategy_engine, utils
 from src.caching import disk_cached_write
+from src.instrumentation import collect_timings, stage, timed
+from src.trading_calendar import TradingCalendar
 from src.trading_strategy import TradingStrategy
 
 
-def import_historical_quote_data(index='MSCI World')->pl.DataFrame:
-    
-    # Map index to file
-    index_file_mapping = {
+# Map index to file
+INDEX_FILE_MAPPING = {
     'MSCI World':'data/daily_msci_world.csv',
     'DAX':'data/daily_DAX.csv',
     'S&P500':'data/daily_S&P500.csv',
     'NASDAQ':'data/daily_NASDAQ.csv',
     }
-    path = index_file_mapping[index]
+
+@timed
+def import_historical_quote_data(index='MSCI World')->pl.DataFrame:
     
-    # Read in df
+    # Load preprocessed quotes from the binary store, rebuilt automatically when the CSV changes
+    path = INDEX_FILE_MAPPING[index]
+    quotes_df = quote_store.load_quotes(path, read_quote_csv)
+    
+    return quotes_df
+
+def get_index_metadata(index:str)->dict:
+    """Year bounds and normalized quotes of an index, computed once per process and version of the data"""
+    return _get_index_metadata(index, get_full_history_fingerprint(index))
+
+@functools.lru_cache(maxsize=2*len(INDEX_FILE_MAPPING))
+@timed
+def _get_index_metadata(index:str, data_fingerprint:str)->dict:
+    quotes_df = import_historical_quote_data(index).sort(by='Date')
+    return {'min_year':quotes_df['Date'][0].year, 'max_year':quotes_df['Date'][-1].year, 'quotes':quotes_df}
+
+def get_chart_quotes(index:str, min_year:int, max_year:int, max_points:int=CHART_MAX_POINTS)->pl.DataFrame:
+    """Normalized quotes of a year window downsampled to at most max_points rows for charts (see 
+    utils.downsample_min_max), computed once per window, resolution and version of the data"""
+    return _get_chart_quotes(index, min_year, max_year, max_points, get_full_history_fingerprint(index))
+
+@functools.lru_cache(maxsize=CHART_CACHE_SIZE)
+@timed
+def _get_chart_quotes(index:str, min_year:int, max_year:int, max_points:int, data_fingerprint:str)->pl.DataFrame:
+    quotes_df = filter_quotes_by_year(get_index_metadata(index)['quotes'], min_year, max_year)
+    return utils.downsample_min_max(quotes_df, max_points)
+
+def import_quote_columns(index='MSCI World')->tuple[np.ndarray, np.ndarray, int]:
+    
+    # Memory-mapped times and closes of the binary store, for the chunked engine on long (e.g. intraday) histories
+    return quote_store.load_quote_columns(INDEX_FILE_MAPPING[index], read_quote_csv)
+
+def read_quote_csv(path:str|io.BytesIO, lazy:bool=False)->pl.DataFrame|pl.LazyFrame:
+    
+    # Read in df (a path or a buffer holding only appended rows), lazily to stream large files into the store
     required_cols = ['Date', 'Close']
-    quotes_df = pl.read_csv(path, infer_schema_length=0)
+    quotes_df = pl.scan_csv(path, infer_schema_length=0) if lazy else pl.read_csv(path, infer_schema_length=0)
     quotes_df = quotes_df.select(required_cols)
     
-    # Clean df by casting datatypes and normalizing prices
-    quotes_df = cast_datatypes(quotes_df)
-    quotes_df = normalize_prices(quotes_df)
+    # Clean df by casting datatypes, prices are normalized by the quote store
+    quotes_df = cast_datatypes(quotes_df, intraday=utils.has_time_of_day(path))
     
     return quotes_df
     
-def cast_datatypes(df:pl.DataFrame):
-    # Cast columns to their correct data types
-    df = df.with_columns(pl.col('Date').str.to_date(format=DATE_FORMAT))
+def cast_datatypes(df:pl.DataFrame|pl.LazyFrame, intraday:bool=False):
+    # Cast columns to their correct data types, intraday quotes keep their time of day
+    if intraday:
+        df = df.with_columns(pl.col('Date').str.to_datetime(format=DATETIME_FORMAT, time_unit='us'))
+    else:
+        df = df.with_columns(pl.col('Date').str.to_date(format=DATE_FORMAT))
     df = df.with_columns([
         pl.col(price_col).str.replace(THOUSAND_SEP, '').cast(pl.Float64) for price_col in ['Close']
     ])
@@ -42,41 +86,53 @@ def cast_datatypes(df:pl.DataFrame):
 
 def normalize_prices(df:pl.DataFrame):
     # Normalize prices (set first value to 100)
-    normalization_factor = 100 / df.filter(pl.col('Date') == pl.col('Date').min())['Close'][0]
+    normalization_factor = utils.get_normalization_factor(df)
     df = df.with_columns(
         [pl.col(col).mul(normalization_factor) for col in ['Close']]    
     )
     return df
 
-def add_cost_average_strategy_dates(df:pl.DataFrame, all_dates:list, over_n_months:int):
-    """Add n "new_investment_dates" to the df, one new date every month"""
-
-    # Prepare input data
-    all_dates = sorted(all_dates)
-    df = df.sort(by='investment_date')
-    start_dates = df['start_date'].to_list()
-    investment_dates =  df['investment_date'].to_list()
-    end_dates = df['end_date'].to_list()
-    
-    investment_date_new_investment_date_dicts = []
-    for i, investment_date in enumerate(investment_dates):
-        investment_date_dict = {}
-        new_investment_dates = []
-        for n in range(0, over_n_months+1):
-            new_investment_date = investment_date + datetime.timedelta(days=n*MONTH_DAYS)
-            new_investment_date_index = bisect.bisect_left(all_dates, new_investment_date)
-            if new_investment_date_index < len(all_dates):
-                if new_investment_date <= end_dates[i]:
-                    new_investment_dates.append(all_dates[new_investment_date_index])
-        investment_date_dict['start_date'] = start_dates[i]
-        investment_date_dict['new_investment_date'] = new_investment_dates
-        investment_date_new_investment_date_dicts.append(investment_date_dict)
-    
-    full_df = pl.from_dicts(investment_date_new_investment_date_dicts).explode('new_investment_date')
+def get_cost_average_schedule(strategy_dict:dict)->pl.DataFrame:
+    """Tranche schedule of the Cost Average Strategy as day offsets from the investment date and weights.
+    
+    By default one equally weighted tranche every month over cost_average_months. Custom schedules (e.g. weekly 
+    or non-equal weights) can be given via the optional keys cost_average_days and cost_average_weights.
+    Returns None if no Cost Average Strategy is used.
+    """
+    if strategy_dict.get('cost_average_days'):
+        day_offsets = list(strategy_dict['cost_average_days'])
+    elif strategy_dict['cost_average_months']:
+        day_offsets = [n*MONTH_DAYS for n in range(0, strategy_dict['cost_average_months']+1)]
+    else:
+        return None
+    weights = strategy_dict.get('cost_average_weights') or [1.0]*len(day_offsets)
+    if len(weights) != len(day_offsets):
+        raise ValueError('Number of cost average weights must match the number of tranches!')
+    
+    return pl.DataFrame({'day_offset':day_offsets, 'weight':weights}, schema={'day_offset':pl.Int32, 'weight':pl.Float64})
+
+def add_cost_average_strategy_dates(df:pl.LazyFrame, quotes_df:pl.LazyFrame, schedule:pl.DataFrame)->pl.LazyFrame:
+    """Add one "new_investment_date" per tranche of the schedule to the df, shifted to the next trading day"""
+    
+    # Shift every investment date by all tranche offsets, only keeping tranches until the end date
+    tranche_df = (df.select(['start_date', 'investment_date', 'end_date'])
+                  .join(schedule.lazy(), how='cross')
+                  .with_columns((pl.col('investment_date') + pl.duration(days=pl.col('day_offset'))).alias('tranche_date'))
+                  .filter(pl.col('tranche_date') <= pl.col('end_date'))
+                  .sort(by='tranche_date'))
+    
+    # Find the next trading day on or after each tranche date
+    full_df = (tranche_df
+               .join_asof(quotes_df.select([pl.col('Date').alias('new_investment_date'), 
+                                            pl.col('Close').alias('new_investment_date_price')]).sort(by='new_investment_date'),
+                          left_on='tranche_date', right_on='new_investment_date', strategy='forward')
+               .filter(pl.col('new_investment_date').is_not_null())
+               .select(['start_date', 'new_investment_date', 'new_investment_date_price', 'weight']))
     
     return full_df
 
-def calculate_total_return_from_df(quotes_df:pl.DataFrame, date_df:pl.DataFrame, strategy_dict:dict)->pl.DataFrame:
+def build_total_return_query(quotes_df:pl.LazyFrame, date_df:pl.LazyFrame, strategy_dict:dict)->pl.LazyFrame:
+    """Lazy query calculating the (annualized) return per start date of the strategy dates"""
     
     # Add prices to start and investment dates
     date_df = (date_df.join(quotes_df.select(['Date', 'Close']), left_on=['investment_date'], right_on=['Date'], how='inner')
@@ -85,30 +141,40 @@ def calculate_total_return_from_df(quotes_df:pl.DataFrame, date_df:pl.DataFrame,
                .rename({'Close':'end_date_price'}))
     
     # Optionally add investment dates from Cost Average Strategy
-    over_n_months = strategy_dict['cost_average_months']
-    if over_n_months:
-        cost_average_date_df = add_cost_average_strategy_dates(date_df, quotes_df['Date'].to_list(), over_n_months)
-        cost_average_date_df = cost_average_date_df.join(quotes_df.rename({'Date':'new_investment_date', 
-                                                                          'Close':'new_investment_date_price'})
-                                                         .select(['new_investment_date', 'new_investment_date_price']),
-                                                         on='new_investment_date')
+    cost_average_schedule = get_cost_average_schedule(strategy_dict)
+    if cost_average_schedule is not None:
+        cost_average_date_df = add_cost_average_strategy_dates(date_df, quotes_df, cost_average_schedule)
         date_df = date_df.join(cost_average_date_df, how='left', on='start_date')
+        equal_weights = cost_average_schedule['weight'].n_unique() == 1
     else:
         date_df = date_df.with_columns([pl.col('investment_date').alias('new_investment_date'),
-                                        pl.col('investment_date_price').alias('new_investment_date_price')])
+                                        pl.col('investment_date_price').alias('new_investment_date_price'),
+                                        pl.lit(1.0).alias('weight')])
+        equal_weights = True
         
     # Calculate total return
     date_df = date_df.with_columns([
         ((pl.col('end_date_price') / pl.col('new_investment_date_price')-1)*100).round(2).alias('total_return'),
     ])
     
-    # Combine returns from same start date (cost average strategy) and calculate (equally weighted) return
-    average_returns_by_start_date = date_df.group_by('start_date').agg(pl.mean('total_return')).sort(by='start_date')
+    # Combine returns from same start date (cost average strategy) and calculate (weighted) return, 
+    # all other columns are the same for every tranche of a start date
+    if equal_weights:
+        average_return = pl.mean('total_return')
+    else:
+        weight_sum = pl.col('weight').filter(pl.col('total_return').is_not_null()).sum()
+        average_return = (pl.when(weight_sum > 0)
+                          .then((pl.col('total_return')*pl.col('weight')).sum() / weight_sum)
+                          .alias('total_return'))
     date_df = (date_df
-               .drop(['new_investment_date','new_investment_date_price', 'total_return']).unique()
-               .join(average_returns_by_start_date, on='start_date')
+               .group_by('start_date')
+               .agg([pl.first('investment_date'), pl.first('end_date'), pl.first('investment_date_price'), 
+                     pl.first('end_date_price'), average_return])
                .sort(by='start_date'))
-    
+
+    # Start dates without tranches (investment after the end date) have no return, the mean of their nulls can
+    # come out as NaN depending on how the group by is parallelized
+    date_df = date_df.with_columns(pl.col('total_return').fill_nan(None))
     
     # Calculate time waited to deploy strategy
     date_df = date_df.with_columns([
@@ -123,10 +189,18 @@ def calculate_total_return_from_df(quotes_df:pl.DataFrame, date_df:pl.DataFrame,
     
     return date_df
 
+@timed
+def calculate_total_return_from_df(quotes_df:pl.DataFrame, date_df:pl.DataFrame, strategy_dict:dict, 
+                                   streaming:bool=False)->pl.DataFrame:
+    
+    # Run the return calculation as one optimized lazy query
+    return build_total_return_query(quotes_df.lazy(), date_df.lazy(), strategy_dict).collect(streaming=streaming)
+
 def run_strategy_for_multiple_start_dates(quotes_df:pl.DataFrame, start_dates:list, end_dates:list, strategy_dict:str)->list[dict]:
     
-    # Instantiate trading strategy objects for all start and end dates
-    all_trading_strategies = [TradingStrategy(quotes_df, start_date=start_date, end_date=end_date) 
+    # Instantiate trading strategy objects for all start and end dates, sharing one trading calendar
+    calendar = TradingCalendar.from_df(quotes_df)
+    all_trading_strategies = [TradingStrategy(quotes_df, start_date=start_date, end_date=end_date, calendar=calendar) 
                               for start_date, end_date in zip(start_dates, end_dates)]
     
     # Drop strategies without an end date (as none was found in the df that fit the criteria)
@@ -142,21 +216,14 @@ def run_strategy_for_multiple_start_dates(quotes_df:pl.DataFrame, start_dates:li
         
     return strategy_dates
 
-def get_strategy_results(quotes_df:pl.DataFrame, strategy_dict:dict)->pl.DataFrame:
+def get_strategy_results_per_start_date(quotes_df:pl.DataFrame, strategy_dict:dict)->pl.DataFrame:
+    """Reference path running one TradingStrategy object per start date (slow, string based)"""
     
     # Determine start and end dates
     max_end_date = quotes_df['Date'].max().strftime(DATE_FORMAT)
-    all_start_dates = [x.strftime(DATE_FORMAT) for x in quotes_df['Date'].unique().to_list()]
-    
-    # If an investment horizon is specified, set end dates to start date + investment horizon
+    all_start_dates = [x.strftime(DATE_FORMAT) for x in quotes_df['Date'].to_list()]
     if strategy_dict['investment_horizon'] != 0:
         end_dates = [utils.add_n_years_to_date(start_date, strategy_dict['investment_horizon']) for start_date in all_start_dates]
-        
-        # Check that at least one end date is in the selected timeframe, catch cases where investment horizon > selected timeframe
-        end_dates_in_df = [utils.find_next_date_in_df(quotes_df, date=date) for date in end_dates]
-        if not any(end_dates_in_df):
-            raise ValueError(f'Investment horizon larger than selected period, please adjust!')
-        
     else:
         end_dates = [max_end_date]*len(all_start_dates)
     
@@ -174,15 +241,61 @@ def get_strategy_results(quotes_df:pl.DataFrame, strategy_dict:dict)->pl.DataFra
     
     return strategy_result_df
 
-def calculate_non_invested_percentage(strategy_result_df:pl.DataFrame)->float:
+def get_end_rows(calendar:TradingCalendar, investment_horizon:int)->np.ndarray:
+    """Row of the end date per start row, calendar.n_rows if no end date was found"""
     
-    strategy_result_df = strategy_result_df.with_columns([
-        (pl.col('end_date') == pl.col('investment_date')).alias('not_invested')
-    ])
+    # If an investment horizon is specified, set end dates to start date + investment horizon
+    if investment_horizon != 0:
+        end_rows = calendar.add_n_years(calendar.day_numbers, investment_horizon)
+        
+        # Check that at least one end date is in the selected timeframe, catch cases where investment horizon > selected timeframe
+        if not (end_rows < calendar.n_rows).any():
+            raise ValueError(f'Investment horizon larger than selected period, please adjust!')
+        
+    else:
+        end_rows = np.full(calendar.n_rows, calendar.n_rows-1)
+    
+    return end_rows
+
+def create_strategy_result_df(calendar:TradingCalendar, buy_rows:np.ndarray, end_rows:np.ndarray, months:int)->pl.DataFrame:
+    
+    # Determine buy days, dropping start dates without an end date
+    day_numbers = calendar.day_numbers
+    has_end_date = end_rows < calendar.n_rows
+    end_rows = np.minimum(end_rows, calendar.n_rows-1)
+    buy_days = strategy_engine.get_buy_days(day_numbers, buy_rows, end_rows, months)
+    
+    # Create df from results
+    strategy_result_df = pl.DataFrame({
+        'start_date':utils.get_dates_from_day_numbers(day_numbers[has_end_date]),
+        'investment_date':utils.get_dates_from_day_numbers(buy_days[has_end_date]),
+        'end_date':utils.get_dates_from_day_numbers(day_numbers[end_rows[has_end_date]]),
+        })
+    
+    return strategy_result_df
+
+@timed
+def get_strategy_results(quotes_df:pl.DataFrame, strategy_dict:dict, vectorized:bool=True)->pl.DataFrame:
+    
+    # Work on int32 epoch days and row offsets, dates are only restored for the result df
+    quotes_df = quotes_df.sort(by='Date')
+    calendar = TradingCalendar.from_df(quotes_df)
+    end_rows = get_end_rows(calendar, strategy_dict['investment_horizon'])
+    
+    if not vectorized:
+        return get_strategy_results_per_start_date(quotes_df, strategy_dict)
+    
+    # Run strategy for all start days in one vectorized pass
+    buy_rows = strategy_engine.first_crossing_rows(quotes_df['Close'].to_numpy(), strategy_dict['percent'])
+    strategy_result_df = create_strategy_result_df(calendar, buy_rows, end_rows, strategy_dict['months'])
+    
+    return strategy_result_df
+
+def get_non_invested_percentage(number_dates_not_invested:int, total_number_dates:int)->float:
     
     # Accound for last day (would always be counted as "not invested")
-    number_dates_not_invested = strategy_result_df['not_invested'].sum() - 1
-    total_number_dates = strategy_result_df['not_invested'].count() -1
+    number_dates_not_invested = number_dates_not_invested - 1
+    total_number_dates = total_number_dates - 1
     
     # Prevent 0 division cases (if always invested)
     if number_dates_not_invested <= 0:
@@ -192,48 +305,422 @@ def calculate_non_invested_percentage(strategy_result_df:pl.DataFrame)->float:
     
     return non_invested_perc
 
-@disk_cached_write
-def run(strategy_dict:dict)->dict:
+def calculate_non_invested_percentage(strategy_result_df:pl.DataFrame)->float:
+    
+    not_invested = strategy_result_df['end_date'] == strategy_result_df['investment_date']
+    
+    return get_non_invested_percentage(not_invested.sum(), not_invested.count())
+
+@timed
+def filter_quotes_by_year(quotes_df:pl.DataFrame, min_year:int, max_year:int)->pl.DataFrame:
+    return quotes_df.filter((pl.col('Date').dt.year() >= min_year)
+                            & (pl.col('Date').dt.year() <= max_year))
+
+def get_bootstrap_options(strategy_dict:dict)->dict:
+    # Optional bootstrap settings of a strategy dict, defaults from the config
+    block_length = strategy_dict.get('bootstrap_block_length', BOOTSTRAP_BLOCK_LENGTH)
+    if block_length < 1:
+        raise ValueError('Bootstrap block length must be at least 1!')
+    return {
+        'n_resamples':strategy_dict.get('bootstrap_resamples', BOOTSTRAP_RESAMPLES),
+        'block_length':block_length,
+        'seed':strategy_dict.get('bootstrap_seed', BOOTSTRAP_SEED),
+    }
+
+@timed
+def calculate_result_dict(strategy_result_df:pl.DataFrame|pl.LazyFrame, n_resamples:int=BOOTSTRAP_RESAMPLES, 
+                          block_length:int=BOOTSTRAP_BLOCK_LENGTH, seed:int=BOOTSTRAP_SEED, 
+                          include_bootstrap:bool=True)->dict:
+    """Summary statistics of the per start date results, incl. a block bootstrap interval of the average return
+
+    Args:
+        strategy_result_df (pl.DataFrame|pl.LazyFrame): per start date results
+        n_resamples (int): number of bootstrap resamples
+        block_length (int): start dates per bootstrap block
+        seed (int): seed of the bootstrap, for reproducible results
+        include_bootstrap (bool): add the bootstrap interval (average_return_se, average_return_bottom and 
+            average_return_top), the most expensive statistic
+
+    Returns:
+        dict: summary statistics
+    """
+    
+    # Calculate all statistics in one query, sharing the work with the returns needed for the bootstrap
+    not_invested = pl.col('end_date') == pl.col('investment_date')
+    statistics_query = strategy_result_df.lazy().select([
+        # Average annualized returns
+        pl.col('annualized_return').mean().alias('average_annualized_return'),
+        # 90%-CI of returns
+        pl.col('annualized_return').quantile(0.05).alias('bottom_pctile'),
+        pl.col('annualized_return').quantile(0.95).alias('top_pctile'),
+        # Average waiting time
+        pl.col('days_waited_to_invest').mean().alias('average_days_waited'),
+        # Cases that did not invest at all over the time
+        not_invested.sum().alias('number_dates_not_invested'),
+        not_invested.count().alias('total_number_dates'),
+        # Standard deviation and range of returns
+        pl.col('annualized_return').std().alias('std'),
+        pl.col('annualized_return').min().alias('min'),
+        pl.col('annualized_return').max().alias('max'),
+    ])
+    returns_query = strategy_result_df.lazy().select(pl.col('annualized_return').cast(pl.Float64).drop_nulls())
+    if include_bootstrap:
+        statistics_df, returns_df = pl.collect_all([statistics_query, returns_query])
+    else:
+        statistics_df = statistics_query.collect()
+    statistics = statistics_df.row(0, named=True)
+
+    # Compile results in dict
+    result_dict = {
+        'average_annualized_return':round(statistics['average_annualized_return'],2),
+        'average_days_waited':int(round(statistics['average_days_waited'],0)),
+        'perc_not_invested':get_non_invested_percentage(statistics['number_dates_not_invested'], 
+                                                        statistics['total_number_dates']),
+        'bottom_pctile':round(statistics['bottom_pctile'],2),
+        'top_pctile':round(statistics['top_pctile'],2),
+        'std':round(statistics['std'],2),
+        'min':round(statistics['min'],2),
+        'max':round(statistics['max'],2),
+    }
+    
+    if include_bootstrap:
+        # Block bootstrap interval of the average return, windows of neighbouring start dates overlap heavily
+        average_return_interval = bootstrap.bootstrap_mean_interval(returns_df['annualized_return'].to_numpy(), 
+                                                                    n_resamples, block_length, BOOTSTRAP_CONFIDENCE, seed)
+        result_dict.update({
+            'average_return_se':round(average_return_interval['standard_error'],2),
+            'average_return_bottom':round(average_return_interval['lower'],2),
+            'average_return_top':round(average_return_interval['upper'],2),
+        })
+    
+    return result_dict
+
+def get_quote_data_fingerprint(strategy_dict:dict)->str:
+    # Version of the data in the year window only, appending rows of later years keeps cached results valid
+    return quote_store.get_data_version(INDEX_FILE_MAPPING[strategy_dict['index']], read_quote_csv,
+                                        strategy_dict['min_year'], strategy_dict['max_year'])
+
+def get_full_history_fingerprint(index:str)->str:
+    return quote_store.get_data_version(INDEX_FILE_MAPPING[index], read_quote_csv)
+
+# Latest full history results per strategy key with their data fingerprint, updated incrementally after appends.
+# Shared by the threads of background runs and grids, least recently stored keys are evicted first
+_previous_full_history_results = collections.OrderedDict()
+_previous_full_history_results_lock = threading.Lock()
+
+def update_full_history_results(quotes_df:pl.DataFrame, strategy_dates_df:pl.DataFrame, strategy_dict:dict,
+                                previous_dates_df:pl.DataFrame, previous_result_df:pl.DataFrame)->pl.DataFrame:
+    """Results for new strategy dates, only recomputing start dates whose dates changed since the previous results
+
+    Start dates with unchanged start, investment and end dates only depend on prices up to their end date,
+    which are not changed by appending rows.
+    """
+    date_cols = ['start_date', 'investment_date', 'end_date']
+    changed_dates_df = strategy_dates_df.select(date_cols).join(previous_dates_df.select(date_cols), on=date_cols, how='anti')
+    unchanged_result_df = previous_result_df.join(strategy_dates_df.select(date_cols), on=date_cols, how='semi')
+    changed_result_df = calculate_total_return_from_df(quotes_df, changed_dates_df, strategy_dict)
+    
+    return pl.concat([unchanged_result_df, changed_result_df]).sort(by='start_date')
+
+def clear_caches()->None:
+    """Clear the in-process full history results, including those kept to update results incrementally"""
+    _get_full_history_results.cache_clear()
+    with _previous_full_history_results_lock:
+        _previous_full_history_results.clear()
+
+@functools.lru_cache(maxsize=FULL_HISTORY_CACHE_SIZE)
+@timed
+def _get_full_history_results(strategy_key:str, data_fingerprint:str)->tuple[pl.DataFrame, pl.DataFrame]:
+    """Strategy dates (with the first price drop date per start date) and results over the full history of an index"""
+    strategy_dict = json.loads(strategy_key)
+    quotes_df = import_historical_quote_data(strategy_dict['index']).sort(by='Date')
+    
+    # Run strategy for all start dates of the full history
+    calendar = TradingCalendar.from_df(quotes_df)
+    end_rows = get_end_rows(calendar, strategy_dict['investment_horizon'])
+    buy_rows = strategy_engine.first_crossing_rows(quotes_df['Close'].to_numpy(), strategy_dict['percent'])
+    strategy_dates_df = create_strategy_result_df(calendar, buy_rows, end_rows, strategy_dict['months'])
+    
+    # After rows were appended to the same base data, only recompute start dates whose dates changed
+    base_id = data_fingerprint.rsplit('-', 1)[0]
+    with _previous_full_history_results_lock:
+        previous_results = _previous_full_history_results.get(strategy_key)
+    if previous_results is not None and previous_results[0] == base_id:
+        strategy_result_df = update_full_history_results(quotes_df, strategy_dates_df, strategy_dict, *previous_results[1:])
+    else:
+        strategy_result_df = calculate_total_return_from_df(quotes_df, strategy_dates_df, strategy_dict)
+    with _previous_full_history_results_lock:
+        _previous_full_history_results[strategy_key] = (base_id, strategy_dates_df, strategy_result_df)
+        _previous_full_history_results.move_to_end(strategy_key)
+        while len(_previous_full_history_results) > FULL_HISTORY_CACHE_SIZE:
+            _previous_full_history_results.popitem(last=False)
+    
+    # Keep the date of the first price drop to detect start dates affected by truncating the history
+    crossing_df = (pl.DataFrame({
+        'start_date':utils.get_dates_from_day_numbers(calendar.day_numbers),
+        'crossing_date':utils.get_dates_from_day_numbers(calendar.day_numbers[np.maximum(buy_rows, 0)]),
+        'has_crossing':buy_rows >= 0,
+        })
+        .select(['start_date', pl.when(pl.col('has_crossing')).then(pl.col('crossing_date')).alias('crossing_date')]))
+    strategy_dates_df = strategy_dates_df.join(crossing_df, on='start_date', how='left')
+    
+    return strategy_dates_df, strategy_result_df
+
+@timed
+def get_window_results(strategy_dict:dict)->pl.DataFrame:
+    """Per start date results for the year window of the strategy dict, sliced from the full history results.
+    
+    Only valid for a fixed investment horizon: start dates whose end date is in the window get the same results, 
+    except when the price drop they wait for only happens after the window, these are recomputed.
+    """
+    min_year, max_year = strategy_dict['min_year'], strategy_dict['max_year']
+    strategy_key = json.dumps({key:value for key, value in strategy_dict.items() if key not in ('min_year', 'max_year')}, 
+                              sort_keys=True)
+    strategy_dates_df, strategy_result_df = _get_full_history_results(strategy_key, 
+                                                                      get_full_history_fingerprint(strategy_dict['index']))
+    
+    # Keep start dates in the window whose end date is in the window as well
+    window_dates_df = strategy_dates_df.filter(pl.col('start_date').dt.year().is_between(min_year, max_year)
+                                               & (pl.col('end_date').dt.year() <= max_year))
+    if window_dates_df.is_empty():
+        raise ValueError(f'Investment horizon larger than selected period, please adjust!')
+    
+    # Take over results of start dates not affected by the truncation
+    is_truncated = (pl.col('crossing_date').dt.year() > max_year).fill_null(False)
+    window_result_df = strategy_result_df.join(window_dates_df.filter(~is_truncated), on='start_date', how='semi')
+    
+    # Recompute start dates whose price drop happens after the window, in the window they never find it
+    truncated_dates_df = window_dates_df.filter(is_truncated)
+    if not truncated_dates_df.is_empty():
+        buy_days = strategy_engine.cap_buy_days(utils.get_day_numbers(truncated_dates_df['start_date']),
+                                                utils.get_day_numbers(truncated_dates_df['end_date']),
+                                                strategy_dict['months'])
+        truncated_dates_df = truncated_dates_df.select([
+            'start_date',
+            utils.get_dates_from_day_numbers(buy_days).alias('investment_date'),
+            'end_date',
+            ])
+        quotes_df = filter_quotes_by_year(import_historical_quote_data(strategy_dict['index']), min_year, max_year)
+        truncated_result_df = calculate_total_return_from_df(quotes_df, truncated_dates_df, strategy_dict)
+        window_result_df = pl.concat([window_result_df, truncated_result_df]).sort(by='start_date')
+    
+    return window_result_df
+
+def build_strategy_result_query(strategy_dict:dict)->pl.LazyFrame:
+    """Lazy query of the per start date results of a strategy dict, as summarized by run"""
+    
+    # With a fixed investment horizon, slice the precomputed full history results instead of recomputing the window
+    if strategy_dict['investment_horizon'] != 0:
+        return get_window_results(strategy_dict).lazy()
     
     # Read in data
     quotes_df = import_historical_quote_data(strategy_dict['index'])
-    quotes_df = quotes_df.filter((pl.col('Date').dt.year() >= strategy_dict['min_year'])
-                               & (pl.col('Date').dt.year() <= strategy_dict['max_year']))
+    quotes_df = filter_quotes_by_year(quotes_df, strategy_dict['min_year'], strategy_dict['max_year'])
     
     # Run strategy to determine investment dates
     strategy_dates_df = get_strategy_results(quotes_df, strategy_dict)
     
-    # Calculate returns
-    strategy_result_df = calculate_total_return_from_df(quotes_df, strategy_dates_df, strategy_dict)
+    # Calculate returns lazily, so they can be fused with the summary statistics
+    return build_total_return_query(quotes_df.lazy(), strategy_dates_df.lazy(), strategy_dict)
+
+def get_result_distribution(strategy_result_df:pl.DataFrame)->dict[str, np.ndarray]:
+    """Per start date returns (float32, NaN if missing) and waiting times (int16) to draw distributions without rerunning"""
+    return {
+        'annualized_return':strategy_result_df['annualized_return'].cast(pl.Float32).fill_null(float('nan')).to_numpy(),
+        'days_waited_to_invest':(strategy_result_df['days_waited_to_invest'].clip(upper_bound=np.iinfo(np.int16).max)
+                                 .cast(pl.Int16).to_numpy()),
+    }
+
+# Per start date results of the distribution, in order
+DISTRIBUTION_SERIES = ['annualized_return', 'days_waited_to_invest']
+
+def get_histogram(values:np.ndarray, n_bins:int=DISTRIBUTION_BINS)->dict[str, np.ndarray]:
+    """Counts of the values (NaN ignored) in n_bins equally wide bins between their min and max
+
+    Returns:
+        dict[str, np.ndarray]: float64 bin_edges (n_bins + 1, all 0 without values) and uint32 counts (n_bins)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return {'bin_edges':np.zeros(n_bins + 1), 'counts':np.zeros(n_bins, dtype=np.uint32)}
+    counts, bin_edges = np.histogram(values, bins=n_bins)
+    return {'bin_edges':bin_edges, 'counts':counts.astype(np.uint32)}
+
+def get_distribution_histograms(distribution:dict[str, np.ndarray], n_bins:int=DISTRIBUTION_BINS)->dict[str, dict]:
+    """Histograms of a distribution (see get_result_distribution), the compact form stored in the answer table"""
+    return {series:get_histogram(distribution[series], n_bins) for series in DISTRIBUTION_SERIES}
+
+def summarize_strategy_results(strategy_result_df:pl.DataFrame|pl.LazyFrame, strategy_dict:dict)->dict:
     
-    # Calculate average annualized returns
-    average_annualized_return_strategy = round(strategy_result_df['annualized_return'].mean(),2)
+    # Materialize the per start date results once if their distribution is returned as well
+    if strategy_dict.get('include_distribution'):
+        strategy_result_df = strategy_result_df.lazy().collect()
+    result_dict = calculate_result_dict(strategy_result_df, **get_bootstrap_options(strategy_dict))
+    if strategy_dict.get('include_distribution'):
+        result_dict['distribution'] = get_result_distribution(strategy_result_df)
     
-    # Calculate 90%-CI of returns
-    bottom_pctile = round(strategy_result_df['annualized_return'].quantile(0.05),2)
-    top_pctile = round(strategy_result_df['annualized_return'].quantile(0.95),2)
-        
-    # Calculate average waiting time
-    average_days_waited = int(round(strategy_result_df['days_waited_to_invest'].mean(),0))
+    return result_dict
+
+@disk_cached_write(fingerprint_func=get_quote_data_fingerprint)
+@timed
+def run(strategy_dict:dict)->dict:
+    """Summary statistics of a strategy, with the optional key include_distribution the result dict also holds 
+    the per start date distribution (see get_result_distribution) under the key distribution"""
     
-    # Calculate % of cases that did not invest at all over the time
-    perc_not_invested = calculate_non_invested_percentage(strategy_result_df)
+    # Calculate returns and summary statistics in one lazy query
+    strategy_result_df = build_strategy_result_query(strategy_dict)
+    result_dict = summarize_strategy_results(strategy_result_df, strategy_dict)
     
-    # Calculate standard deviation of returns
-    std_returns = round(strategy_result_df['annualized_return'].std(),2)
-    min_return = round(strategy_result_df['annualized_return'].min(),2)
-    max_return = round(strategy_result_df['annualized_return'].max(),2)
+    return result_dict
 
-    # Compile results in dict
-    result_dict = {
-        'average_annualized_return':average_annualized_return_strategy,
-        'average_days_waited':average_days_waited,
-        'perc_not_invested':perc_not_invested,
-        'bottom_pctile':bottom_pctile,
-        'top_pctile':top_pctile,
-        'std':std_returns,
-        'min':min_return,
-        'max':max_return,
-    }
+class RunCancelled(Exception):
+    pass
+
+@timed
+def run_in_chunks(strategy_dict:dict, chunk_size:int=RUN_CHUNK_SIZE, progress_callback:Callable[[float], None]=None, 
+                  cancel_event:threading.Event=None)->dict:
+    """Uncached run computing the returns in chunks of start dates, to report progress and stop early when cancelled
+
+    Args:
+        strategy_dict (dict): strategy dict as accepted by run
+        chunk_size (int): start dates per chunk
+        progress_callback (Callable[[float], None], optional): called with the share of start dates done after each chunk
+        cancel_event (threading.Event, optional): checked before each chunk, raises RunCancelled once it is set
+
+    Returns:
+        dict: same result dict as run
+    """
+    def check_cancelled():
+        if cancel_event is not None and cancel_event.is_set():
+            raise RunCancelled(f'Run of {strategy_dict} was cancelled')
+    
+    # Results sliced from the full history are cheap, only the other returns are calculated in chunks
+    if strategy_dict['investment_horizon'] != 0:
+        strategy_result_df = get_window_results(strategy_dict)
+    else:
+        quotes_df = import_historical_quote_data(strategy_dict['index'])
+        quotes_df = filter_quotes_by_year(quotes_df, strategy_dict['min_year'], strategy_dict['max_year'])
+        strategy_dates_df = get_strategy_results(quotes_df, strategy_dict)
+        
+        # Returns of a start date don't depend on other start dates, so chunks can be calculated independently
+        strategy_result_dfs = []
+        for offset in range(0, strategy_dates_df.height, chunk_size):
+            check_cancelled()
+            strategy_result_dfs.append(calculate_total_return_from_df(quotes_df, strategy_dates_df.slice(offset, chunk_size), 
+                                                                      strategy_dict))
+            if progress_callback is not None:
+                progress_callback(min(offset + chunk_size, strategy_dates_df.height) / strategy_dates_df.height)
+        strategy_result_df = pl.concat(strategy_result_dfs)
+    
+    check_cancelled()
+    result_dict = summarize_strategy_results(strategy_result_df, strategy_dict)
+    if progress_callback is not None:
+        progress_callback(1.0)
     
     return result_dict
+
+def run_with_diagnostics(strategy_dict:dict, track_allocations:bool=False)->tuple[dict, list[dict]]:
+    """Run the strategy while recording wall time, row counts and (optionally) allocations per stage
+
+    Returns:
+        tuple[dict, list[dict]]: result dict of run and one timing dict per stage
+    """
+    with collect_timings(track_allocations) as collector:
+        with stage('total'):
+            result_dict = run(strategy_dict)
+    
+    return result_dict, collector.to_dicts()
+
+def run_grid(index:str, min_year:int, max_year:int, percents:list[int], months:list[int], 
+             investment_horizons:list[int], cost_average_months:list[int], include_bootstrap:bool=False, 
+             include_histograms:bool=False)->pl.DataFrame:
+    """Run all combinations of the given strategy parameters for one index and period, sharing the 
+    loaded quotes, the trading calendar and the per-percent crossing rows across all combinations
+
+    Args:
+        index (str): index to run the strategies on
+        min_year (int): first year of the period
+        max_year (int): last year of the period
+        percents (list[int]): percentage drops to wait for
+        months (list[int]): max months to wait
+        investment_horizons (list[int]): investment horizons in years, 0 for max
+        cost_average_months (list[int]): months to spread the investment over, 0 for none
+        include_bootstrap (bool): add the bootstrap interval of the average return (see calculate_result_dict)
+        include_histograms (bool): add the histograms of the distribution (see get_distribution_histograms) as 
+            list columns <series>_bin_edges and <series>_counts
+
+    Returns:
+        pl.DataFrame: one row per parameter combination with the metrics of run, 
+            metrics are null if the investment horizon is larger than the period
+    """
+    # Read in data and prepare shared lookups once, crossing rows of all percents are searched in one pass
+    quotes_df = import_historical_quote_data(index)
+    quotes_df = filter_quotes_by_year(quotes_df, min_year, max_year).sort(by='Date')
+    calendar = TradingCalendar.from_df(quotes_df)
+    close = quotes_df['Close'].to_numpy()
+    range_min_table = strategy_engine.build_range_min_table(close)
+    crossing_rows = strategy_engine.first_crossing_rows_matrix(close, np.array(percents), range_min_table)
+    buy_rows_by_percent = {percent:crossing_rows[:, column] for column, percent in enumerate(percents)}
+    end_rows_by_horizon = {}
+    for investment_horizon in investment_horizons:
+        try:
+            end_rows_by_horizon[investment_horizon] = get_end_rows(calendar, investment_horizon)
+        except ValueError:
+            end_rows_by_horizon[investment_horizon] = None
+    
+    # Run all parameter combinations
+    result_dicts = []
+    for percent, max_months, investment_horizon, over_n_months in itertools.product(
+        percents, months, investment_horizons, cost_average_months):
+        strategy_dict = {
+            'index':index,
+            'min_year':min_year,
+            'max_year':max_year,
+            'months':max_months,
+            'percent':percent,
+            'investment_horizon':investment_horizon,
+            'cost_average_months':over_n_months,
+        }
+        end_rows = end_rows_by_horizon[investment_horizon]
+        if end_rows is None:
+            result_dicts.append(strategy_dict)
+            continue
+        
+        strategy_dates_df = create_strategy_result_df(calendar, buy_rows_by_percent[percent], end_rows, max_months)
+        strategy_result_df = calculate_total_return_from_df(quotes_df, strategy_dates_df, strategy_dict)
+        result_dict = {**strategy_dict, **calculate_result_dict(strategy_result_df, **get_bootstrap_options(strategy_dict),
+                                                                include_bootstrap=include_bootstrap)}
+        if include_histograms:
+            histograms = get_distribution_histograms(get_result_distribution(strategy_result_df))
+            result_dict.update({f'{series}_{key}':values.tolist() for series, histogram in histograms.items()
+                                for key, values in histogram.items()})
+        result_dicts.append(result_dict)
+    
+    grid_result_df = pl.from_dicts(result_dicts, infer_schema_length=None)
+    
+    return grid_result_df
+
+@timed
+def get_down_percent_sensitivity(quotes_df:pl.DataFrame, percents:list[int]=PERCENT_OPTIONS)->pl.DataFrame:
+    """Share of start dates whose price dropped x percent later on and the days it took, for a whole vector of 
+    percents from one (start date x percent) days-to-buy matrix
+
+    Returns:
+        pl.DataFrame: percent, perc_reached (% of start dates) and average_days_to_buy (null if never reached)
+    """
+    quotes_df = quotes_df.sort(by='Date')
+    days_to_buy = strategy_engine.days_to_buy_matrix(utils.get_day_numbers(quotes_df['Date']), 
+                                                     quotes_df['Close'].to_numpy(), np.array(percents))
+    has_crossing = days_to_buy >= 0
+    n_crossing = has_crossing.sum(axis=0)
+    days_sum = np.where(has_crossing, days_to_buy, 0).sum(axis=0, dtype=np.int64)
+    
+    sensitivity_df = pl.DataFrame({
+        'percent':percents,
+        'perc_reached':np.round(n_crossing / max(len(quotes_df), 1) * 100, 2),
+        'average_days_to_buy':np.round(days_sum / np.maximum(n_crossing, 1), 0),
+        })
+    
+    return sensitivity_df.with_columns(pl.when(pl.Series(n_crossing) > 0).then(pl.col('average_days_to_buy'))
+                                       .alias('average_days_to_buy'))
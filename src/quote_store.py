@@ -0,0 +1,351 @@
+import contextlib
+import datetime
+import fcntl
+import hashlib
+import io
+import json
+import mmap
+import os
+import tempfile
+from typing import Callable, Iterator
+
+import numpy as np
+import polars as pl
+
+from config import DATE_FORMAT, DATETIME_FORMAT
+from src import utils
+
+STORE_DIR = 'data/store'
+HASH_BLOCK_BYTES = 2**24
+
+
+def get_store_path(csv_path:str)->str:
+    file_name = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(STORE_DIR, f'{file_name}.arrow')
+
+def get_source_fingerprint(csv_path:str)->str:
+    """Fingerprint of the source CSV, changes whenever the file is modified"""
+    stat = os.stat(csv_path)
+    return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+def get_file_hash(csv_path:str, n_bytes:int=None)->str:
+    """MD5 of the first n bytes of a file (whole file if None), read in blocks to hash files of any size"""
+    file_hash = hashlib.md5()
+    with open(csv_path, 'rb') as f:
+        n_bytes_left = n_bytes if n_bytes is not None else os.fstat(f.fileno()).st_size
+        while n_bytes_left > 0:
+            block = f.read(min(n_bytes_left, HASH_BLOCK_BYTES))
+            if not block:
+                break
+            file_hash.update(block)
+            n_bytes_left -= len(block)
+    return file_hash.hexdigest()
+
+def get_temp_path(path:str)->str:
+    """New empty temp file next to path, unique per writer so concurrent writers never replace each other's files"""
+    file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', 
+                                                  prefix=f'{os.path.basename(path)}.', suffix='.tmp')
+    os.close(file_descriptor)
+    return temp_path
+
+@contextlib.contextmanager
+def store_lock(store_path:str):
+    """Exclusive lock of a store across threads and processes, held while the store is built or updated"""
+    os.makedirs(os.path.dirname(store_path), exist_ok=True)
+    with open(f'{store_path}.lock', 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def read_metadata(store_path:str)->dict:
+    try:
+        with open(f'{store_path}.json') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def write_store(df:'pl.DataFrame|pl.LazyFrame|pa.RecordBatchReader', store_path:str, metadata:dict)->dict:
+    """Write the df (streamed if lazy or a batch reader) as Arrow IPC file and its metadata, via temp files so 
+    concurrent readers never see partial writes. The watermark (last date) of the written data is added to the metadata.
+
+    Returns:
+        dict: metadata as written
+    """
+    os.makedirs(os.path.dirname(store_path), exist_ok=True)
+    temp_store_path = get_temp_path(store_path)
+    temp_metadata_path = get_temp_path(f'{store_path}.json')
+    try:
+        if isinstance(df, pl.LazyFrame):
+            df.sink_ipc(temp_store_path, compression=None)
+        elif isinstance(df, pl.DataFrame):
+            df.write_ipc(temp_store_path, compression='uncompressed')
+        else:
+            import pyarrow as pa
+            with pa.OSFile(temp_store_path, 'wb') as sink, pa.ipc.new_file(sink, df.schema) as writer:
+                for batch in df:
+                    writer.write_batch(batch)
+        metadata = {**metadata, 'watermark':format_watermark(pl.scan_ipc(temp_store_path).select(pl.col('Date').max())
+                                                             .collect().item())}
+        with open(temp_metadata_path, 'w') as f:
+            json.dump(metadata, f)
+        os.replace(temp_store_path, store_path)
+        os.replace(temp_metadata_path, f'{store_path}.json')
+    finally:
+        remove_temp_files([temp_store_path, temp_metadata_path])
+    return metadata
+
+def remove_temp_files(temp_paths:list[str])->None:
+    # Temp files left by a failed write, already renamed ones no longer exist
+    for temp_path in temp_paths:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+
+def format_watermark(date:datetime.date|datetime.datetime)->str:
+    # ISO format, intraday watermarks keep their time of day
+    return date.strftime(DATETIME_FORMAT if isinstance(date, datetime.datetime) else DATE_FORMAT)
+
+def parse_watermark(watermark:str)->datetime.date|datetime.datetime:
+    if len(watermark) > len('YYYY-MM-DD'):
+        return datetime.datetime.strptime(watermark, DATETIME_FORMAT)
+    return datetime.datetime.strptime(watermark, DATE_FORMAT).date()
+
+def get_source_metadata(csv_path:str)->dict:
+    stat = os.stat(csv_path)
+    return {'source_fingerprint':get_source_fingerprint(csv_path), 'source_size':stat.st_size,
+            'source_hash':get_file_hash(csv_path)}
+
+def build_store(csv_path:str, store_path:str, read_csv_func:Callable)->dict:
+    """Stream the CSV into the store, normalizing prices. Starts a new base version, invalidating all results"""
+    lazy_df = read_csv_func(csv_path, lazy=True)
+    normalization_factor = utils.get_normalization_factor(lazy_df)
+    lazy_df = lazy_df.with_columns(pl.col('Close').mul(normalization_factor))
+    years = lazy_df.select(pl.col('Date').dt.year().unique()).collect(streaming=True)['Date']
+
+    source_metadata = get_source_metadata(csv_path)
+    metadata = {
+        **source_metadata,
+        'base_id':source_metadata['source_hash'],
+        'normalization_factor':normalization_factor,
+        'data_version':0,
+        'year_versions':{str(year):0 for year in sorted(years.to_list())},
+    }
+    return write_store(lazy_df, store_path, metadata)
+
+def append_to_store(store_path:str, new_df:pl.DataFrame, metadata:dict, source_metadata:dict)->dict:
+    """Append new (not normalized) rows after the watermark to the store and bump the version of the touched years"""
+    new_df = new_df.with_columns(pl.col('Close').mul(metadata['normalization_factor'])).sort(by='Date')
+    watermark = parse_watermark(metadata['watermark'])
+
+    data_version = metadata['data_version'] + 1
+    year_versions = dict(metadata['year_versions'])
+    for year in new_df['Date'].dt.year().unique().to_list():
+        year_versions[str(year)] = data_version
+    metadata = {
+        **metadata,
+        **source_metadata,
+        'data_version':data_version,
+        'year_versions':year_versions,
+    }
+    import pyarrow as pa
+    with pa.memory_map(store_path) as source:
+        store_reader = pa.ipc.open_file(source)
+        batch_reader = pa.RecordBatchReader.from_batches(
+            store_reader.schema, iter_appended_batches(store_reader, new_df, watermark))
+        return write_store(batch_reader, store_path, metadata)
+
+def iter_appended_batches(store_reader:'pa.ipc.RecordBatchFileReader', new_df:pl.DataFrame,
+                          watermark:datetime.date|datetime.datetime)->'Iterator[pa.RecordBatch]':
+    """Record batches of the store up to the watermark (in case another process already appended the same rows) 
+    followed by the new rows, streamed batch by batch so the history is never loaded at once"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    date_type = store_reader.schema.field('Date').type
+    for batch_number in range(store_reader.num_record_batches):
+        batch = store_reader.get_batch(batch_number)
+        yield batch.filter(pc.less_equal(batch.column('Date'), pa.scalar(watermark, type=date_type)))
+    yield from new_df.to_arrow().cast(store_reader.schema).to_batches()
+
+def read_appended_rows(csv_path:str, metadata:dict, read_csv_func:Callable)->pl.DataFrame:
+    """Parse only the rows appended to the CSV since the store was last synced, None if the CSV wasn't only appended to"""
+    old_size = metadata['source_size']
+    if os.path.getsize(csv_path) <= old_size or get_file_hash(csv_path, old_size) != metadata['source_hash']:
+        return None
+    with open(csv_path, 'rb') as f:
+        header = f.readline()
+        f.seek(old_size - 1)
+        old_content_end = f.read(1)
+        appended_content = f.read()
+    if old_content_end != b'\n':
+        return None
+
+    # Parse the appended lines with the CSV header, only rows after the watermark are accepted
+    appended_df = read_csv_func(io.BytesIO(header + appended_content.lstrip(b'\r\n')))
+    if appended_df.is_empty() or appended_df['Date'].min() <= parse_watermark(metadata['watermark']):
+        return None
+    return appended_df
+
+def is_store_current(csv_path:str, store_path:str, metadata:dict)->bool:
+    return bool(metadata) and os.path.exists(store_path) and metadata['source_fingerprint'] == get_source_fingerprint(csv_path)
+
+def sync_store(csv_path:str, read_csv_func:Callable)->dict:
+    """Bring the store up to date with the CSV: nothing if unchanged, append if rows were appended, else rebuild.
+    Only one thread or process updates a store at a time, the others wait and use its result.
+
+    Returns:
+        dict: metadata of the store
+    """
+    store_path = get_store_path(csv_path)
+    metadata = read_metadata(store_path)
+    if is_store_current(csv_path, store_path, metadata):
+        return metadata
+    with store_lock(store_path):
+        return _sync_store(csv_path, read_csv_func)
+
+def _sync_store(csv_path:str, read_csv_func:Callable)->dict:
+    # Sync while holding the lock of the store, another writer may have synced it while waiting for the lock
+    store_path = get_store_path(csv_path)
+    metadata = read_metadata(store_path)
+    if is_store_current(csv_path, store_path, metadata):
+        return metadata
+
+    if metadata and os.path.exists(store_path):
+        appended_df = read_appended_rows(csv_path, metadata, read_csv_func)
+        if appended_df is not None:
+            return append_to_store(store_path, appended_df, metadata, get_source_metadata(csv_path))
+
+    return build_store(csv_path, store_path, read_csv_func)
+
+def load_quotes(csv_path:str, read_csv_func:Callable)->pl.DataFrame:
+    """Load the preprocessed quotes of a CSV from the memory-mapped store, updating it if the CSV changed
+
+    Args:
+        csv_path (str): path of the source CSV
+        read_csv_func (Callable): parses and cleans (but doesn't normalize) a CSV path or buffer, used to build the store
+
+    Returns:
+        pl.DataFrame: cleaned and normalized quotes
+    """
+    sync_store(csv_path, read_csv_func)
+    return pl.read_ipc(get_store_path(csv_path), memory_map=True)
+
+def get_column_paths(store_path:str)->dict[str, str]:
+    return {'times':f'{store_path}.times', 'close':f'{store_path}.close', 'metadata':f'{store_path}.columns.json'}
+
+def write_columns(store_path:str, metadata:dict)->dict:
+    """Export Date (int64 time units since epoch) and Close (float64) of the store as raw arrays that can be 
+    memory-mapped as one contiguous array each, streamed record batch by record batch
+
+    Returns:
+        dict: metadata of the columns with the data version of the store, number of rows and time unit
+    """
+    column_paths = get_column_paths(store_path)
+    temp_paths = {name:get_temp_path(path) for name, path in column_paths.items()}
+    try:
+        columns_metadata = _write_columns(store_path, metadata, temp_paths)
+        for name, path in column_paths.items():
+            os.replace(temp_paths[name], path)
+    finally:
+        remove_temp_files(list(temp_paths.values()))
+    return columns_metadata
+
+def _write_columns(store_path:str, metadata:dict, temp_paths:dict[str, str])->dict:
+    time_unit = None
+    n_rows = 0
+    import pyarrow as pa
+    with pa.memory_map(store_path) as source, open(temp_paths['times'], 'wb') as times_file, \
+         open(temp_paths['close'], 'wb') as close_file:
+        reader = pa.ipc.open_file(source)
+        for batch_number in range(reader.num_record_batches):
+            batch = reader.get_batch(batch_number)
+            times = batch.column('Date').to_numpy(zero_copy_only=False)
+            time_unit = np.datetime_data(times.dtype)[0]
+            times_file.write(times.astype(np.int64).tobytes())
+            close_file.write(batch.column('Close').to_numpy(zero_copy_only=False).astype(np.float64).tobytes())
+            n_rows += len(times)
+
+    columns_metadata = {'data_version':f"{metadata['base_id']}-{metadata['data_version']}", 'n_rows':n_rows,
+                        'time_unit':time_unit or 'D'}
+    with open(temp_paths['metadata'], 'w') as f:
+        json.dump(columns_metadata, f)
+    return columns_metadata
+
+def map_array(path:str, dtype:np.dtype)->np.ndarray:
+    """Read-only array backed by a memory map of a raw array file, pages are only loaded when accessed"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return np.empty(0, dtype=dtype)
+        return np.frombuffer(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), dtype=dtype)
+
+def release_mapped_pages(array:np.ndarray)->None:
+    """Drop the loaded pages of a memory-mapped array (or a view of it) from memory, they are reread when accessed"""
+    base = array
+    while isinstance(base, np.ndarray):
+        base = base.base
+    if isinstance(base, memoryview):
+        base = base.obj
+    if isinstance(base, mmap.mmap):
+        base.madvise(mmap.MADV_DONTNEED)
+
+def read_columns_metadata(store_path:str)->dict:
+    try:
+        with open(get_column_paths(store_path)['metadata']) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def load_quote_columns(csv_path:str, read_csv_func:Callable)->tuple[np.ndarray, np.ndarray, int]:
+    """Memory-mapped times and closes of a CSV from the store, for histories too long to load at once
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, int]: int64 times since epoch, float64 normalized closes and time units per day
+            (1 for daily quotes in epoch days, 86_400_000_000 for intraday quotes in microseconds)
+    """
+    metadata = sync_store(csv_path, read_csv_func)
+    store_path = get_store_path(csv_path)
+    column_paths = get_column_paths(store_path)
+    columns_metadata = read_columns_metadata(store_path)
+    if columns_metadata.get('data_version') != f"{metadata['base_id']}-{metadata['data_version']}":
+        # Export the columns of the store version read above, unless another writer did while waiting for the lock
+        with store_lock(store_path):
+            metadata = _sync_store(csv_path, read_csv_func)
+            columns_metadata = read_columns_metadata(store_path)
+            if columns_metadata.get('data_version') != f"{metadata['base_id']}-{metadata['data_version']}":
+                columns_metadata = write_columns(store_path, metadata)
+
+    units_per_day = int(np.timedelta64(1, 'D') // np.timedelta64(1, columns_metadata['time_unit']))
+    return map_array(column_paths['times'], np.int64), map_array(column_paths['close'], np.float64), units_per_day
+
+def ingest_quotes(csv_path:str, new_quotes_df:pl.DataFrame, read_csv_func:Callable)->dict:
+    """Append new trading days (Date, not normalized Close) to the CSV and the store without reparsing the history
+
+    Rows on or before the current watermark are ignored, so ingesting the same data twice is a no-op.
+
+    Returns:
+        dict: metadata of the store with the new data version and watermark
+    """
+    # Hold the lock of the store, so concurrent ingests don't append the same rows twice
+    with store_lock(get_store_path(csv_path)):
+        metadata = _sync_store(csv_path, read_csv_func)
+        new_quotes_df = (new_quotes_df.select(['Date', 'Close']).sort(by='Date')
+                         .filter(pl.col('Date') > parse_watermark(metadata['watermark'])))
+        if new_quotes_df.is_empty():
+            return metadata
+
+        # Append to the source CSV first, the store then picks up only the appended rows
+        with open(csv_path, 'a') as f:
+            for date, close in new_quotes_df.iter_rows():
+                f.write(f'{format_watermark(date)},{close}\n')
+        return _sync_store(csv_path, read_csv_func)
+
+def get_data_version(csv_path:str, read_csv_func:Callable, min_year:int=None, max_year:int=None)->str:
+    """Version of the data of a CSV (optionally only of a year window), changes whenever that data changes.
+
+    Appending rows only changes the version of windows containing the years of the appended rows.
+    """
+    metadata = sync_store(csv_path, read_csv_func)
+    year_versions = [version for year, version in metadata['year_versions'].items()
+                     if (min_year is None or int(year) >= min_year) and (max_year is None or int(year) <= max_year)]
+    return f"{metadata['base_id']}-{max(year_versions, default=0)}"
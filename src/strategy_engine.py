@@ -0,0 +1,123 @@
+import numpy as np
+
+from config import MONTH_DAYS
+
+
+def build_range_min_table(close:np.ndarray)->list[np.ndarray]:
+    """Build a sparse table for range-minimum queries over the close prices
+
+    Args:
+        close (np.ndarray): close prices sorted by date
+
+    Returns:
+        list[np.ndarray]: level k holds min(close[i:i+2**k]) for every valid i
+    """
+    table = [close]
+    level = 1
+    while (1 << level) <= len(close):
+        prev = table[-1]
+        half = 1 << (level - 1)
+        table.append(np.minimum(prev[:-half], prev[half:]))
+        level += 1
+    return table
+
+def first_crossing_indices(close:np.ndarray, thresholds:np.ndarray, table:list[np.ndarray]=None, 
+                           start_rows:np.ndarray=None)->np.ndarray:
+    """Determine for every start row the first row on or after it where the price is at or below
+    the row's threshold, using a binary-lifting search over the range-minimum table
+
+    Args:
+        close (np.ndarray): close prices sorted by date
+        thresholds (np.ndarray): buy threshold per start row
+        table (list[np.ndarray], optional): precomputed range-minimum table of close
+        start_rows (np.ndarray, optional): rows to search from, defaults to every row
+
+    Returns:
+        np.ndarray: row index of the first crossing per start row, -1 if the price never crosses
+    """
+    if table is None:
+        table = build_range_min_table(close)
+    n_rows = len(close)
+
+    # Jump ahead as long as the whole block ahead stays above the threshold
+    pos = np.arange(n_rows) if start_rows is None else np.asarray(start_rows, dtype=np.int64)
+    for level in reversed(range(len(table))):
+        level_mins = table[level]
+        in_range = pos < len(level_mins)
+        block_min = level_mins[np.where(in_range, pos, 0)]
+        pos = pos + (in_range & (block_min > thresholds)) * (1 << level)
+
+    return np.where(pos < n_rows, pos, -1)
+
+def add_months_to_dates(dates:np.ndarray, months:int)->np.ndarray:
+    """Vectorized equivalent of date + relativedelta(months=+months) (day clipped to month end)"""
+    month_starts = dates.astype('datetime64[M]')
+    day_offsets = dates - month_starts.astype('datetime64[D]')
+    target_months = month_starts + months
+    target_month_lengths = (target_months + 1).astype('datetime64[D]') - target_months.astype('datetime64[D]')
+    return target_months.astype('datetime64[D]') + np.minimum(day_offsets, target_month_lengths - 1)
+
+def cap_buy_days(start_days:np.ndarray, buy_days:np.ndarray, months:int, units_per_day:int=1)->np.ndarray:
+    """Set buy days more than n months after their start day to start day + n months (may be a non-trading day),
+    intraday times (units_per_day > 1) keep the time of day of their start"""
+    if months <= 0:
+        return buy_days
+    start_buy_month_dif = (buy_days - start_days) / (MONTH_DAYS*units_per_day)
+    start_day_numbers, time_of_day = np.divmod(start_days, units_per_day)
+    capped_day_numbers = add_months_to_dates(start_day_numbers.astype('datetime64[D]'), months).astype(np.int64)
+    capped_days = (capped_day_numbers*units_per_day + time_of_day).astype(buy_days.dtype)
+    return np.where(start_buy_month_dif > months, capped_days, buy_days)
+
+def first_crossing_rows(close:np.ndarray, percent:int, table:list[np.ndarray]=None)->np.ndarray:
+    """Row of the earliest day on or after each start row when the price dropped x percent, -1 if never"""
+    thresholds = close - (percent/100)*close
+    return first_crossing_indices(close, thresholds, table)
+
+def first_crossing_rows_matrix(close:np.ndarray, percents:np.ndarray, table:list[np.ndarray]=None)->np.ndarray:
+    """First crossing rows of every start row for a whole vector of percents in one pass over the sorted percents
+
+    A larger drop can't be reached before a smaller one, so the search for each percent continues from the 
+    crossing rows of the next smaller percent, and start rows without a crossing are dropped from later searches.
+
+    Args:
+        close (np.ndarray): close prices sorted by date
+        percents (np.ndarray): percentage drops to wait for, in any order
+        table (list[np.ndarray], optional): precomputed range-minimum table of close
+
+    Returns:
+        np.ndarray: int32 matrix (start row x percent) of the first crossing rows, -1 if the price never crosses,
+            column j equals first_crossing_rows(close, percents[j])
+    """
+    if table is None:
+        table = build_range_min_table(close)
+    percents = np.asarray(percents)
+    crossing_rows = np.full((len(close), len(percents)), -1, dtype=np.int32)
+
+    # Start rows still searched and the row to continue their search from
+    active_rows = np.arange(len(close))
+    search_rows = active_rows
+    for column in np.argsort(percents, kind='stable'):
+        active_close = close[active_rows]
+        thresholds = active_close - (percents[column]/100)*active_close
+        rows = first_crossing_indices(close, thresholds, table, start_rows=search_rows)
+        has_crossing = rows >= 0
+        active_rows, search_rows = active_rows[has_crossing], rows[has_crossing]
+        crossing_rows[active_rows, column] = search_rows
+
+    return crossing_rows
+
+def days_to_buy_matrix(day_numbers:np.ndarray, close:np.ndarray, percents:np.ndarray, 
+                       table:list[np.ndarray]=None)->np.ndarray:
+    """Days from every start day to the first x percent drop for a whole vector of percents
+
+    Returns:
+        np.ndarray: int32 matrix (start row x percent) of calendar days until the drop, -1 if it never happens
+    """
+    crossing_rows = first_crossing_rows_matrix(close, percents, table)
+    days_to_buy = day_numbers[np.maximum(crossing_rows, 0)] - day_numbers[:, None]
+    return np.where(crossing_rows >= 0, days_to_buy, -1).astype(np.int32)
+
+def get_buy_days(day_numbers:np.ndarray, buy_rows:np.ndarray, end_rows:np.ndarray, months:int)->np.ndarray:
+    """Turn first-crossing rows into buy days, falling back to the end day and applying the max waiting time"""
+    buy_days = np.where(buy_rows >= 0, day_numbers[buy_rows], day_numbers[end_rows])
+    return cap_buy_days(day_numbers, buy_days, months)
@@ -0,0 +1,57 @@
+import numpy as np
+import polars as pl
+
+from src import utils
+
+
+class TradingCalendar():
+    def __init__(self, dates:pl.Series) -> None:
+        """Lookup of the next trading day on or after any calendar day, built once per quote df
+
+        Args:
+            dates (pl.Series): trading dates of the quote df
+        """
+        if dates.dtype != pl.Date:
+            # A dense array over every time unit of intraday quotes doesn't fit in memory
+            raise ValueError(f'Quotes with {dates.dtype} dates are not daily, use chunked_engine.run_chunked '
+                             'for intraday quotes')
+        self.day_numbers = utils.get_day_numbers(dates.sort())
+        self.n_rows = len(self.day_numbers)
+        self.first_day = int(self.day_numbers[0]) if self.n_rows else 0
+        last_day = int(self.day_numbers[-1]) if self.n_rows else -1
+
+        # Dense array mapping every calendar day between first and last trading day to the row of the next trading day
+        all_days = np.arange(self.first_day, last_day + 1)
+        self.next_row_by_day = np.searchsorted(self.day_numbers, all_days, side='left').astype(np.int32)
+
+    @classmethod
+    def from_df(cls, df:pl.DataFrame)->'TradingCalendar':
+        return cls(df['Date'])
+
+    def next_rows(self, day_numbers:np.ndarray)->np.ndarray:
+        """Row of the next trading day on or after each day, n_rows if there is none"""
+        offsets = np.asarray(day_numbers, dtype=np.int64) - self.first_day
+        n_days = len(self.next_row_by_day)
+        if n_days == 0:
+            return np.full(offsets.shape, self.n_rows, dtype=np.int32)
+        rows = self.next_row_by_day[np.clip(offsets, 0, n_days - 1)]
+        return np.where(offsets >= n_days, self.n_rows, rows).astype(np.int32)
+
+    def next_days(self, day_numbers:np.ndarray)->np.ndarray:
+        """Next trading day (epoch day) on or after each day, -1 if there is none"""
+        rows = self.next_rows(day_numbers)
+        if self.n_rows == 0:
+            return np.full(rows.shape, -1)
+        has_next_day = rows < self.n_rows
+        return np.where(has_next_day, self.day_numbers[np.where(has_next_day, rows, 0)], -1)
+
+    def next_date(self, date:str)->str:
+        """Next trading date on or after a date string, empty string if there is none"""
+        day_number = self.next_days(np.array([utils.get_day_number_from_str(date)]))[0]
+        if day_number < 0:
+            return ''
+        return utils.get_str_from_day_number(day_number)
+
+    def add_n_years(self, day_numbers:np.ndarray, n_years:int)->np.ndarray:
+        """Row of the next trading day on or after each day + n years (n*365 days), n_rows if there is none"""
+        return self.next_rows(utils.add_n_years_to_days(day_numbers, n_years))
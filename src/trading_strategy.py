@@ -3,13 +3,14 @@ from dateutil.relativedelta import relativedelta
 import polars as pl
 
 from src import utils
+from src.trading_calendar import TradingCalendar
 from config import DATE_FORMAT, MONTH_DAYS
 
 class TradingStrategy():
-    def __init__(self, df:pl.DataFrame, start_date:str, end_date:str) -> None:
+    def __init__(self, df:pl.DataFrame, start_date:str, end_date:str, calendar:TradingCalendar=None) -> None:
         self.df = df
-        self.start_date = utils.find_next_date_in_df(df, start_date)
-        self.end_date = utils.find_next_date_in_df(df, end_date)
+        self.start_date = utils.find_next_date_in_df(df, start_date, calendar=calendar)
+        self.end_date = utils.find_next_date_in_df(df, end_date, calendar=calendar)
     
     def down_percent_pure(self, percent)->str:
         """Determine buy date by waiting until price drops by X-percent
@@ -45,13 +46,12 @@ class TradingStrategy():
         buy_date = self.down_percent_pure(percent)
         if months > 0:
              # Check if date is less that n months after start date
-            start_buy_day_dif = (datetime.strptime(buy_date,DATE_FORMAT) 
-                                - datetime.strptime(self.start_date,DATE_FORMAT)).days
+            start_date = datetime.strptime(self.start_date,DATE_FORMAT)
+            start_buy_day_dif = (datetime.strptime(buy_date,DATE_FORMAT) - start_date).days
             start_buy_month_dif = start_buy_day_dif / MONTH_DAYS
             # If buy date is more than n months after start date, set buy date to start date + n months
             if start_buy_month_dif > months:
-                buy_date = (datetime.strptime(self.start_date,DATE_FORMAT) 
-                                + relativedelta(months=+months)).strftime(DATE_FORMAT)
+                buy_date = (start_date + relativedelta(months=+months)).strftime(DATE_FORMAT)
         
         return buy_date
     
\ No newline at end of file
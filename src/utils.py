@@ -1,9 +1,17 @@
 import datetime
+import io
+import numpy as np
 import polars as pl
 
 from config import DATE_SEP, DATE_FORMAT
 
-def find_next_date_in_df(df:pl.DataFrame, date:str)->str:
+EPOCH = datetime.date(1970, 1, 1)
+
+def find_next_date_in_df(df:pl.DataFrame, date:str, calendar=None)->str:
+    # Use the precomputed trading calendar of the df if available
+    if calendar is not None:
+        return calendar.next_date(date)
+    
     pl_date = pl.date(*(int(x) for x in date.split(DATE_SEP)))
     relevant_dates = df.filter(pl.col('Date') >= pl_date)
     next_date_df = relevant_dates.select(pl.col('Date').min())
@@ -15,13 +23,72 @@ def find_next_date_in_df(df:pl.DataFrame, date:str)->str:
         
     return next_date
 
+def has_time_of_day(source:str|io.BytesIO)->bool:
+    """Check if the dates of a quote CSV (path or buffer) have a time of day, e.g. minute bars"""
+    if isinstance(source, io.BytesIO):
+        lines = source.getvalue()[:1024].splitlines()
+    else:
+        with open(source, 'rb') as f:
+            lines = f.read(1024).splitlines()
+    if len(lines) < 2:
+        return False
+    date_col = [col.strip('" ') for col in lines[0].decode('utf-8-sig').split(',')].index('Date')
+    return len(lines[1].split(b',')[date_col].strip(b'" ')) > len('YYYY-MM-DD')
+
 def get_polars_date_from_str(date_str:str)->pl.Date:
     return pl.date(*(int(x) for x in date_str.split(DATE_SEP)))
 
+def get_normalization_factor(df:pl.DataFrame|pl.LazyFrame, price_col:str='Close')->float:
+    # Factor setting the price of the first date to 100, lazy frames are streamed (first date, then its price)
+    first_date = df.lazy().select(pl.col('Date').min()).collect(streaming=True).item()
+    first_price_df = df.lazy().filter(pl.col('Date') == first_date).select(price_col).head(1).collect(streaming=True)
+    return 100 / first_price_df[price_col][0]
+
 def get_price_of_day(df:pl.DataFrame, date_str:str, price_type='Close')->float:
     return df.filter(pl.col('Date')==get_polars_date_from_str(date_str))[price_type][0]
 
 def add_n_years_to_date(date:str, n_years:int)->str:
     shifted_date = datetime.datetime.strptime(date, DATE_FORMAT) + datetime.timedelta(days=n_years*365)
     shifted_date_str = shifted_date.strftime(DATE_FORMAT)
-    return shifted_date_str
\ No newline at end of file
+    return shifted_date_str
+
+def get_day_numbers(dates:pl.Series)->np.ndarray:
+    """Convert a pl.Date series to int32 days since epoch"""
+    return dates.to_physical().to_numpy()
+
+def get_dates_from_day_numbers(day_numbers:np.ndarray)->pl.Series:
+    """Convert int32 days since epoch back to a pl.Date series"""
+    return pl.Series(day_numbers, dtype=pl.Int32).cast(pl.Date)
+
+def get_day_number_from_str(date_str:str)->int:
+    return (datetime.datetime.strptime(date_str, DATE_FORMAT).date() - EPOCH).days
+
+def get_str_from_day_number(day_number:int)->str:
+    return (EPOCH + datetime.timedelta(days=int(day_number))).strftime(DATE_FORMAT)
+
+def add_n_years_to_days(day_numbers:np.ndarray, n_years:int)->np.ndarray:
+    """Vectorized add_n_years_to_date on epoch days"""
+    return day_numbers + n_years*365
+
+def downsample_min_max(df:pl.DataFrame, max_points:int, value_col:str='Close')->pl.DataFrame:
+    """Rows of the min and max value of equally sized buckets of consecutive rows (plus the first and last row),
+    so a series drawn at lower resolution keeps its extremes, e.g. the bottoms of drawdowns
+
+    Args:
+        df (pl.DataFrame): series sorted by time
+        max_points (int): max number of rows returned
+        value_col (str): column whose extremes are kept
+
+    Returns:
+        pl.DataFrame: at most max_points rows (at least 4) of df in their original order, df itself if it isn't longer
+    """
+    if df.height <= max_points:
+        return df
+    n_buckets = max(1, (max_points - 2) // 2)
+    extreme_rows_df = (df.select(value_col).with_row_index('row')
+                       .group_by((pl.col('row') * n_buckets // df.height).alias('bucket'))
+                       .agg(pl.col('row').get(pl.col(value_col).arg_min()).alias('min_row'),
+                            pl.col('row').get(pl.col(value_col).arg_max()).alias('max_row')))
+    rows = np.unique(np.concatenate([[0, df.height - 1], extreme_rows_df['min_row'].to_numpy(),
+                                     extreme_rows_df['max_row'].to_numpy()]))
+    return df[rows]
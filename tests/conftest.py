@@ -0,0 +1,19 @@
+import shutil
+
+import pytest
+
+from src import caching, main, quote_store
+
+
+@pytest.fixture
+def isolated_index(tmp_path, monkeypatch):
+    """Name of a test index with a copy of the DAX CSV, its own store and an empty result cache"""
+    csv_path = tmp_path / 'daily_TEST.csv'
+    shutil.copy(main.INDEX_FILE_MAPPING['DAX'], csv_path)
+    monkeypatch.setitem(main.INDEX_FILE_MAPPING, 'TEST', str(csv_path))
+    monkeypatch.setattr(quote_store, 'STORE_DIR', str(tmp_path / 'store'))
+    monkeypatch.setattr(caching, 'cache', caching.ResultCache(directory=str(tmp_path / 'cache')))
+    main.clear_caches()
+    yield 'TEST'
+    caching.cache.close()
+    main.clear_caches()
@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from src import answer_table, main
+
+
+@pytest.fixture
+def table_path(isolated_index, tmp_path, monkeypatch):
+    # Threads instead of processes, the test index only exists in this process
+    monkeypatch.setattr(answer_table, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    path = str(tmp_path / 'answer_table')
+    answer_table.build_answer_table(path, indices=[isolated_index], percents=[10], max_workers=1)
+    return path
+
+def get_strategy_dict(index:str)->dict:
+    min_year, max_year = answer_table.get_full_history_window(index)
+    return {'index':index, 'min_year':min_year, 'max_year':max_year, 'percent':10, 'months':3,
+            'investment_horizon':10, 'cost_average_months':0}
+
+def test_lookup_equals_run(isolated_index, table_path):
+    strategy_dict = get_strategy_dict(isolated_index)
+
+    result_dict = answer_table.lookup(strategy_dict, table_path)
+
+    assert result_dict == {metric:value for metric, value in main.run(strategy_dict).items()
+                           if metric in answer_table.METRICS}
+
+def test_lookup_histograms_equal_run_distribution(isolated_index, table_path):
+    strategy_dict = {**get_strategy_dict(isolated_index), 'include_distribution':True}
+
+    histograms = answer_table.lookup(strategy_dict, table_path)['histograms']
+
+    expected_histograms = main.get_distribution_histograms(main.run(strategy_dict)['distribution'])
+    assert histograms.keys() == expected_histograms.keys()
+    for series, histogram in histograms.items():
+        np.testing.assert_array_equal(histogram['counts'], expected_histograms[series]['counts'])
+        np.testing.assert_array_equal(histogram['bin_edges'], expected_histograms[series]['bin_edges'])
+    assert 'histograms' not in answer_table.lookup({**strategy_dict, 'include_distribution':False}, table_path)
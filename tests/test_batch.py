@@ -0,0 +1,21 @@
+import polars as pl
+
+from src import batch
+
+
+def get_config(index:str, **strategy_values)->dict:
+    return {'index':index, 'min_year':2015, 'max_year':2020, 'percent':5, 'months':3, 'investment_horizon':1,
+            'cost_average_months':0, 'bootstrap_resamples':100, **strategy_values}
+
+def test_fractional_percent_is_kept_and_bad_configs_fail_alone(isolated_index, tmp_path):
+    configs = [get_config(isolated_index, percent=7.5), get_config(isolated_index, months='3'),
+               get_config(isolated_index, months=2.5)]
+
+    counts = batch.run_batch(configs, str(tmp_path), verbose=False)
+
+    summary_df = pl.read_parquet(batch.get_part_paths(str(tmp_path), 'summary'))
+    assert counts == {'run':3, 'skipped':0, 'failed':2}
+    assert summary_df['percent'].to_list() == [7.5, None, None]
+    assert summary_df['average_annualized_return'][0] is not None
+    assert summary_df['error'][1].startswith('ValueError')
+    assert summary_df['error'][2].startswith('ValueError')
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from src import bootstrap, main
+
+
+def test_batched_means_equal_unbatched_means():
+    values = np.random.default_rng(1).normal(size=1000)
+
+    batched_means = bootstrap.block_bootstrap_means(values, 500, 1, seed=0, batch_size=3000)
+    unbatched_means = bootstrap.block_bootstrap_means(values, 500, 1, seed=0, batch_size=None)
+
+    np.testing.assert_allclose(batched_means, unbatched_means)
+
+@pytest.mark.parametrize('block_length', [0, -5])
+def test_block_length_below_one_is_rejected(block_length):
+    with pytest.raises(ValueError):
+        bootstrap.block_bootstrap_means(np.ones(10), 10, block_length)
+    with pytest.raises(ValueError):
+        main.get_bootstrap_options({'bootstrap_block_length':block_length})
+
+def test_run_grid_bootstrap_is_opt_in(isolated_index):
+    grid_args = (isolated_index, 2010, 2020, [5], [3], [1], [0])
+
+    grid_df = main.run_grid(*grid_args)
+    bootstrap_grid_df = main.run_grid(*grid_args, include_bootstrap=True)
+
+    bootstrap_columns = ['average_return_se', 'average_return_bottom', 'average_return_top']
+    assert not set(bootstrap_columns) & set(grid_df.columns)
+    assert grid_df.equals(bootstrap_grid_df.drop(bootstrap_columns))
@@ -0,0 +1,75 @@
+import collections
+import threading
+import time
+
+import pytest
+
+from src import caching
+
+
+@pytest.fixture
+def result_cache(tmp_path, monkeypatch):
+    result_cache = caching.ResultCache(directory=str(tmp_path / 'cache'))
+    monkeypatch.setattr(caching, 'cache', result_cache)
+    yield result_cache
+    result_cache.close()
+
+def run_concurrently(func, n_threads:int)->list:
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(func())) for _ in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_concurrent_calls_are_computed_once_and_counted_once(result_cache):
+    calls = []
+
+    @caching.disk_cached_write
+    def slow_square(x:int)->int:
+        calls.append(x)
+        time.sleep(0.3)
+        return x*x
+
+    results = run_concurrently(lambda: slow_square(3), 8)
+    slow_square(3)
+
+    stats = caching.get_cache_stats()
+    assert results == [9]*8
+    assert len(calls) == 1
+    assert stats['misses'] == 1
+    assert stats['coalesced_hits'] == 7
+    assert stats['memory_hits'] + stats['disk_hits'] == 1
+    assert stats['hit_rate'] == round(8/9, 4)
+
+def test_failed_leader_is_taken_over(result_cache):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        if len(calls) == 1:
+            raise RuntimeError('leader failed')
+        return 'result'
+
+    def call():
+        try:
+            return caching.single_flight('key', compute)
+        except RuntimeError:
+            return 'failed'
+
+    results = run_concurrently(call, 4)
+
+    assert collections.Counter(results) == {'failed':1, ('result', True):1, ('result', False):2}
+    assert len(calls) == 2
+
+def test_waiting_caller_computes_after_timeout(result_cache):
+    leader = threading.Thread(target=lambda: caching.single_flight('key', lambda: time.sleep(1) or 'leader'))
+    leader.start()
+    time.sleep(0.1)
+
+    result = caching.single_flight('key', lambda: 'follower', wait_timeout=0.2)
+    leader.join()
+
+    assert result == ('follower', True)
@@ -0,0 +1,50 @@
+import datetime
+import sqlite3
+
+import polars as pl
+import pytest
+
+from db import db_funcs
+
+
+@pytest.fixture
+def db_uri(tmp_path):
+    """URI of a SQLite stand-in of the price database with two indices"""
+    db_path = tmp_path / 'prices.db'
+    with sqlite3.connect(db_path) as connection:
+        connection.execute('CREATE TABLE indices (id INTEGER PRIMARY KEY, "index" TEXT)')
+        connection.execute('CREATE TABLE prices (id_index INTEGER, date TEXT, closing_price REAL)')
+        connection.executemany('INSERT INTO indices VALUES (?, ?)', [(1, 'DAX'), (2, 'NASDAQ')])
+        connection.executemany('INSERT INTO prices VALUES (?, ?, ?)', [
+            (1, '2024-01-03', 101.5), (1, '2024-01-02', 100.0), (2, '2024-01-02', 200.0),
+        ])
+    return f'sqlite:///{db_path}'
+
+def test_get_price_data_by_indices(db_uri):
+    price_dfs = db_funcs.get_price_data_by_indices(['DAX', 'NASDAQ', 'MSCI World'], db_uri=db_uri)
+
+    assert price_dfs['DAX'].equals(pl.DataFrame({'Date':[datetime.date(2024, 1, 2), datetime.date(2024, 1, 3)],
+                                                 'Close':[100.0, 101.5]}))
+    assert price_dfs['NASDAQ']['Close'].to_list() == [200.0]
+    assert price_dfs['MSCI World'].is_empty()
+    assert price_dfs['MSCI World'].schema == {'Date':pl.Date, 'Close':pl.Float64}
+
+def test_parameters_are_bound_not_interpolated(db_uri):
+    price_dfs = db_funcs.get_price_data_by_indices(["DAX') OR ('1'='1"], db_uri=db_uri)
+
+    assert price_dfs["DAX') OR ('1'='1"].is_empty()
+
+def test_execute_sql_select_query_binds_scalar_and_list_parameters(db_uri):
+    result_df = db_funcs.execute_sql_select_query(
+        'SELECT closing_price FROM prices WHERE id_index IN :ids AND date > :date ORDER BY date',
+        {'ids':[1, 2], 'date':'2024-01-02'}, db_uri=db_uri)
+
+    assert result_df['closing_price'].to_list() == [101.5]
+
+def test_to_positional_query_expands_lists_and_keeps_casts():
+    query, parameters = db_funcs.to_positional_query(
+        'SELECT date::text FROM prices WHERE id_index IN :ids AND date > :date OR id_index IN :none',
+        {'ids':[1, 2], 'date':'2024-01-02', 'none':[]})
+
+    assert query == 'SELECT date::text FROM prices WHERE id_index IN ($1, $2) AND date > $3 OR id_index IN (NULL)'
+    assert parameters == [1, 2, '2024-01-02']
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from src import chunked_engine, main, strategy_engine
+
+
+@pytest.mark.parametrize('strategy_dict', [
+    {'percent':5, 'months':3, 'investment_horizon':1},
+    {'percent':10, 'months':0, 'investment_horizon':0},
+    {'percent':0, 'months':12, 'investment_horizon':2},
+])
+def test_vectorized_strategy_dates_equal_per_start_date_path(isolated_index, strategy_dict):
+    quotes_df = main.filter_quotes_by_year(main.import_historical_quote_data(isolated_index), 2015, 2018)
+
+    vectorized_df = main.get_strategy_results(quotes_df, strategy_dict)
+    reference_df = main.get_strategy_results(quotes_df, strategy_dict, vectorized=False)
+
+    assert vectorized_df.equals(reference_df)
+
+def test_first_crossing_rows_matrix_equals_single_searches(isolated_index):
+    close = main.import_historical_quote_data(isolated_index).sort(by='Date')['Close'].to_numpy()
+    percents = np.array([30, 0, 5, 1, 60, 10, 100])
+
+    crossing_rows = strategy_engine.first_crossing_rows_matrix(close, percents)
+
+    for column, percent in enumerate(percents):
+        np.testing.assert_array_equal(crossing_rows[:, column], strategy_engine.first_crossing_rows(close, percent))
+
+def count_truncated_start_dates(index:str, strategy_dict:dict)->int:
+    # Start dates of the window whose price drop only happens after it, recomputed by get_window_results
+    quotes_df = main.import_historical_quote_data(index).sort(by='Date')
+    buy_rows = strategy_engine.first_crossing_rows(quotes_df['Close'].to_numpy(), strategy_dict['percent'])
+    crossing_years = quotes_df['Date'].dt.year().to_numpy()[np.maximum(buy_rows, 0)]
+    start_years = quotes_df['Date'].dt.year().to_numpy()
+    in_window = (start_years >= strategy_dict['min_year']) & (start_years <= strategy_dict['max_year'])
+    return int((in_window & (buy_rows >= 0) & (crossing_years > strategy_dict['max_year'])).sum())
+
+@pytest.mark.parametrize('strategy_dict', [
+    {'min_year':1990, 'max_year':2024, 'percent':5, 'months':3, 'investment_horizon':1, 'cost_average_months':0},
+    {'min_year':2003, 'max_year':2007, 'percent':20, 'months':0, 'investment_horizon':1, 'cost_average_months':0},
+    {'min_year':1995, 'max_year':1999, 'percent':30, 'months':24, 'investment_horizon':2, 'cost_average_months':3},
+    {'min_year':2010, 'max_year':2015, 'percent':10, 'months':6, 'investment_horizon':5, 'cost_average_months':12},
+])
+def test_window_results_equal_filtered_quotes(isolated_index, strategy_dict):
+    strategy_dict = {'index':isolated_index, **strategy_dict}
+    quotes_df = main.filter_quotes_by_year(main.import_historical_quote_data(isolated_index),
+                                           strategy_dict['min_year'], strategy_dict['max_year'])
+
+    window_result_df = main.get_window_results(strategy_dict)
+    reference_df = main.calculate_total_return_from_df(
+        quotes_df, main.get_strategy_results(quotes_df, strategy_dict), strategy_dict)
+
+    assert window_result_df.sort(by='start_date').equals(reference_df.sort(by='start_date'))
+
+def test_window_results_cover_truncated_crossings(isolated_index):
+    # The crossings of the windows above that fall after max_year exercise the recomputation of get_window_results
+    assert count_truncated_start_dates(isolated_index, {'min_year':2003, 'max_year':2007, 'percent':20}) > 0
+    assert count_truncated_start_dates(isolated_index, {'min_year':1995, 'max_year':1999, 'percent':30}) > 0
+
+@pytest.mark.parametrize('chunk_rows', [None, 777])
+@pytest.mark.parametrize('strategy_dict', [
+    {'min_year':1980, 'max_year':2024, 'percent':5, 'months':6, 'investment_horizon':5, 'cost_average_months':0},
+    {'min_year':2000, 'max_year':2010, 'percent':20, 'months':0, 'investment_horizon':0, 'cost_average_months':6},
+    {'min_year':1960, 'max_year':2024, 'percent':10, 'months':3, 'investment_horizon':1, 'cost_average_months':0,
+     'cost_average_days':[0, 7, 14, 40], 'cost_average_weights':[1, 2, 3, 4]},
+])
+def test_chunked_engine_equals_run(isolated_index, strategy_dict, chunk_rows):
+    strategy_dict = {'index':isolated_index, **strategy_dict, 'bootstrap_resamples':200}
+    times, close, units_per_day = main.import_quote_columns(isolated_index)
+
+    chunked_result = chunked_engine.run_on_columns(times, close, units_per_day, strategy_dict, chunk_rows=chunk_rows)
+
+    assert chunked_result == main.run(strategy_dict)
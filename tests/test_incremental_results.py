@@ -0,0 +1,54 @@
+import datetime
+
+import polars as pl
+import pytest
+
+from src import caching, main, quote_store
+
+
+def falling_quotes(csv_path:str, n_days:int, daily_change:float=-0.01)->pl.DataFrame:
+    # Business days after the last quote of the CSV with the close falling by the same share every day
+    quotes_df = main.read_quote_csv(csv_path).sort(by='Date')
+    date, close = quotes_df['Date'][-1], quotes_df['Close'][-1]
+    rows = []
+    while len(rows) < n_days:
+        date += datetime.timedelta(days=1)
+        if date.weekday() < 5:
+            close *= 1 + daily_change
+            rows.append((date, close))
+    return pl.DataFrame(rows, schema=['Date', 'Close'], orient='row')
+
+def run_from_scratch(strategy_dict:dict)->dict:
+    main.clear_caches()
+    caching.cache.clear()
+    return main.run(strategy_dict)
+
+@pytest.mark.parametrize('cost_average_months', [0, 12])
+def test_incremental_results_equal_full_recompute_after_append(isolated_index, cost_average_months, monkeypatch):
+    incremental_updates = []
+    update_full_history_results = main.update_full_history_results
+    monkeypatch.setattr(main, 'update_full_history_results', 
+                        lambda *args: incremental_updates.append(1) or update_full_history_results(*args))
+    strategy_dict = {'index':isolated_index, 'min_year':2000, 'max_year':2024, 'percent':30, 'months':0,
+                     'investment_horizon':1, 'cost_average_months':cost_average_months}
+    main.run(strategy_dict)
+
+    # Appended falling days give start dates whose investment date is after their end date
+    csv_path = main.INDEX_FILE_MAPPING[isolated_index]
+    quote_store.ingest_quotes(csv_path, falling_quotes(csv_path, 57), main.read_quote_csv)
+    incremental_result = main.run(strategy_dict)
+    assert incremental_updates
+
+    assert incremental_result == run_from_scratch(strategy_dict)
+
+def test_start_dates_without_tranches_have_null_returns(isolated_index):
+    strategy_dict = {'index':isolated_index, 'percent':30, 'months':0, 'investment_horizon':1, 'cost_average_months':12}
+    quotes_df = main.import_historical_quote_data(isolated_index).sort(by='Date')
+    dates = quotes_df['Date']
+    date_df = pl.DataFrame({'start_date':[dates[-300], dates[-299]], 'investment_date':[dates[-10], dates[-9]],
+                            'end_date':[dates[-50], dates[-49]]})
+
+    result_df = main.calculate_total_return_from_df(quotes_df, date_df, strategy_dict)
+
+    assert result_df['total_return'].null_count() == 2
+    assert result_df['annualized_return'].null_count() == 2
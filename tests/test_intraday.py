@@ -0,0 +1,56 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from src import chunked_engine, main
+
+
+START_TIME = datetime.datetime(2020, 1, 6, 9)
+
+def get_minute_bars()->list[tuple[datetime.datetime, float]]:
+    # Minute bars of five weeks, prices fall within each hour and rise over each week
+    return [(START_TIME + datetime.timedelta(days=day, minutes=minute), 100 + (day % 7) - minute / 100)
+            for day in range(35) for minute in range(60)]
+
+@pytest.fixture
+def intraday_index(isolated_index):
+    # Replace the CSV of the test index with the minute bars
+    with open(main.INDEX_FILE_MAPPING[isolated_index], 'w') as f:
+        f.write('Date,Close\n')
+        for time, close in get_minute_bars():
+            f.write(f'{time:%Y-%m-%d %H:%M:%S},{close}\n')
+    return isolated_index
+
+def get_expected_waiting(percent:float)->dict:
+    """Average whole days waited and share not invested, by searching the first drop of every start minute directly
+    (no investment horizon and no max waiting time, so every start waits until the drop or the last minute)"""
+    times, close = zip(*get_minute_bars())
+    close = np.array(close)
+    days_waited, n_not_invested = [], 0
+    for row in range(len(close)):
+        crossings = np.flatnonzero(close[row+1:] <= close[row] - percent/100*close[row])
+        investment_row = row + 1 + crossings[0] if len(crossings) else len(close) - 1
+        days_waited.append((times[investment_row] - times[row]).days)
+        n_not_invested += investment_row == len(close) - 1
+    return {'average_days_waited':int(round(np.mean(days_waited), 0)),
+            'perc_not_invested':main.get_non_invested_percentage(n_not_invested, len(close))}
+
+def test_run_rejects_intraday_quotes(intraday_index):
+    strategy_dict = {'index':intraday_index, 'min_year':2020, 'max_year':2020, 'percent':2, 'months':0,
+                     'investment_horizon':0, 'cost_average_months':0}
+
+    with pytest.raises(ValueError, match='run_chunked'):
+        main.run(strategy_dict)
+
+@pytest.mark.parametrize('percent', [2, 4])
+def test_run_chunked_handles_intraday_quotes(intraday_index, percent):
+    strategy_dict = {'index':intraday_index, 'min_year':2020, 'max_year':2020, 'percent':percent, 'months':0,
+                     'investment_horizon':0, 'cost_average_months':0, 'bootstrap_resamples':200}
+    times, close, units_per_day = main.import_quote_columns(intraday_index)
+
+    result_dict = chunked_engine.run_chunked(strategy_dict)
+
+    expected_waiting = get_expected_waiting(percent)
+    assert {key:result_dict[key] for key in expected_waiting} == expected_waiting
+    assert result_dict == chunked_engine.run_on_columns(times, close, units_per_day, strategy_dict, chunk_rows=7)